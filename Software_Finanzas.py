@@ -3,8 +3,19 @@
 # Guardado JSON, exportar PDF (reportlab) y Excel (pandas/openpyxl). Usa Pillow para cargar imágenes.
 
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import ttk, filedialog, messagebox, simpledialog
 import json
+import hashlib
+import time
+import argparse
+import asyncio
+import io
+import multiprocessing
+from collections import deque
+import functools
+import csv
+from array import array
+import numpy as np
 import pandas as pd
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image as RLImage
 from reportlab.lib.styles import getSampleStyleSheet
@@ -13,6 +24,7 @@ from reportlab.lib import colors
 from reportlab.lib.units import cm
 from datetime import datetime
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 # Optional: Pillow for robust image loading in Tkinter
 try:
@@ -21,6 +33,13 @@ try:
 except:
     PIL_AVAILABLE = False
 
+# Optional: inotify para el modo de vigilancia de carpeta (si no, se revisan los mtime)
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+    INOTIFY_AVAILABLE = True
+except ImportError:
+    INOTIFY_AVAILABLE = False
+
 # ---------- Paths to logos (usaste dos imágenes subidas) ----------
 LOGO_IPN_PATH = "/mnt/data/d2c12a3e-e1cf-4863-b53f-e66afe37d81d.png"
 LOGO_UPIIZ_PATH = "/mnt/data/a9567d8d-74a9-41bd-9f99-03170b6a2094.png"
@@ -55,6 +74,1429 @@ def money(x):
     except:
         return "$0.00"
 
+# ---------- Cálculo de estados ----------
+def calcular_estado_resultados(vals):
+    """Calcula el Estado de Resultados a partir de los valores capturados por sección.
+
+    Sólo usa sumas y restas, así que también acepta arreglos de NumPy como valores.
+    """
+    ventas_tot = vals.get("Ventas totales", 0)
+    devV = vals.get("devoluciones sobre ventas", 0)
+    descV = vals.get("descuentos sobre ventas", 0)
+    ventas_net = ventas_tot - devV - descV
+
+    inv_ini = vals.get("inventario inicial", 0)
+    compras = vals.get("compras", 0)
+    gastos_compra = vals.get("gastos de compra", 0)
+    compras_totales = compras + gastos_compra
+    devC = vals.get("devoluciones sobre compras", 0)
+    descC = vals.get("descuentos sobre compras", 0)
+    compras_netas = compras_totales - devC - descC
+    suma_merc = inv_ini + compras_netas
+    inv_fin = vals.get("inventario final", 0)
+    costo_vendido = suma_merc - inv_fin
+
+    utilidad_bruta = ventas_net - costo_vendido
+
+    gastos_venta_total = vals.get("Renta de almacen", 0) + vals.get("Propaganda y publicidad", 0) + vals.get("Sueldos de agentes y dependeientes", 0) + vals.get("comisiones de agentes y dependientes", 0) + vals.get("consumo de luz del almacen", 0)
+    gastos_admin_total = vals.get("Renta de oficinas", 0) + vals.get("sueldos del personal de oficinas", 0) + vals.get("papeleria y utiles", 0) + vals.get("consumo de luz de oficinas", 0) + vals.get("depreciacion del ejercicio", 0)
+    gastos_operacion_total = gastos_venta_total + gastos_admin_total
+
+    productos_financieros = vals.get("Intereses cobrados", 0) + vals.get("ganancia en cambios", 0)
+    gastos_financieros = vals.get("intereses pagados", 0) + vals.get("perdida en cambios", 0)
+
+    utilidad_operacion = utilidad_bruta - gastos_operacion_total + productos_financieros - gastos_financieros
+
+    otros_gastos = vals.get("Perdida en venta de mobiliario", 0) + vals.get("perdida en venta de acciones", 0)
+    otros_productos = vals.get("Comisiones cobradas", 0) + vals.get("dividendos cobrados", 0)
+    perdida_entre_otros = vals.get("perdida entre otros gastos y productos", 0)
+
+    utilidad_antes_isr_ptu = utilidad_operacion - otros_gastos + otros_productos - perdida_entre_otros
+
+    isr = vals.get("Impuesto  sobre la renta ISR", 0)
+    ptu = vals.get("Participacion de los trabajadores en las utilidades", 0)
+    utilidad_neta = utilidad_antes_isr_ptu - isr - ptu
+
+    return {
+        "Ventas totales": ventas_tot,
+        "devoluciones sobre ventas": devV,
+        "descuentos sobre ventas": descV,
+        "ventas netas": ventas_net,
+        "inventario inicial": inv_ini,
+        "compras": compras,
+        "gastos de compra": gastos_compra,
+        "compras totales": compras_totales,
+        "devoluciones sobre compras": devC,
+        "descuentos sobre compras": descC,
+        "compras netas": compras_netas,
+        "suma o total de mercancías": suma_merc,
+        "inventario final": inv_fin,
+        "costo de lo vendido": costo_vendido,
+        "utilidad bruta": utilidad_bruta,
+        "gastos de operación": gastos_operacion_total,
+        "gastos de venta detalle": {
+            "Renta de almacen": vals.get("Renta de almacen", 0),
+            "Propaganda y publicidad": vals.get("Propaganda y publicidad", 0),
+            "Sueldos de agentes y dependeientes": vals.get("Sueldos de agentes y dependeientes", 0),
+            "comisiones de agentes y dependientes": vals.get("comisiones de agentes y dependientes", 0),
+            "consumo de luz del almacen": vals.get("consumo de luz del almacen", 0)
+        },
+        "gastos de administracion detalle": {
+            "Renta de oficinas": vals.get("Renta de oficinas", 0),
+            "sueldos del personal de oficinas": vals.get("sueldos del personal de oficinas", 0),
+            "papeleria y utiles": vals.get("papeleria y utiles", 0),
+            "consumo de luz de oficinas": vals.get("consumo de luz de oficinas", 0),
+            "depreciacion del ejercicio": vals.get("depreciacion del ejercicio", 0)
+        },
+        "productos_financieros": productos_financieros,
+        "gastos_financieros": gastos_financieros,
+        "utilidad_operacion": utilidad_operacion,
+        "otros_gastos_detalle": {
+            "Perdida en venta de mobiliario": vals.get("Perdida en venta de mobiliario", 0),
+            "perdida en venta de acciones": vals.get("perdida en venta de acciones", 0)
+        },
+        "otros_productos_detalle": {
+            "Comisiones cobradas": vals.get("Comisiones cobradas", 0),
+            "dividendos cobrados": vals.get("dividendos cobrados", 0)
+        },
+        "perdida_entre_otros": perdida_entre_otros,
+        "utilidad_antes_isr_ptu": utilidad_antes_isr_ptu,
+        "ISR": isr,
+        "PTU": ptu,
+        "utilidad_neta": utilidad_neta
+    }
+
+def calcular_balance(bal):
+    """Calcula el Balance General a partir de los valores capturados por sección."""
+    activo_cir = sum([bal.get(k,0) for k in ["Caja","Bancos","Inversiones temporales", "Mercancías", "Inventario o almacén", "Clientes", "Documentos por cobrar", "Deudores diversos", "Anticipo a proveedores"]])
+    activo_no_cir = sum([bal.get(k,0) for k in ["Terrenos","Edificios","Mobiliario","Equipo de computo electrónico", "Equipo de entrega o reparto", "Depositos en garantía", "Inversiones permanentes"]]) 
+    activo_dif = sum([bal.get(k,0) for k in ["Gastos de Inversión y Desarrollo", "Gastos en Etapas Prosperativas, de Organización y Administración","Gastos de Mercadotecnia","Gastos de instalación","Papeleria y útiles","Propaganda y Publicidad","Primas de seguros","Rentas Pagadas por Anticipado","Intereses Pagados por Anticipado"]]) 
+    total_activos = activo_cir + activo_no_cir + activo_dif
+
+    pasivo_corto = sum([bal.get(k,0) for k in ["Proveedores","Acreedores diversos","Documentos por pagar","Anticipo de clientes","Gastos Pendientes de Pago, por Pagar o Acumulados","Impuestos Pendientes de Pago, por Pagar o Acumulados"]])
+    pasivo_largo = sum([bal.get(k,0) for k in ["Hipotecas por pagar o Acreedores Hipotecarios","Documentos por Pagar a Largo Plazo","Cuentas por Pagar a Largo Plazo"]])
+    pasivo_dif = sum([bal.get(k,0) for k in ["Rentas Cobradas por Anticipado","Intereses Cobrados por Anticipado"]])
+    total_pasivos = pasivo_corto + pasivo_largo + pasivo_dif
+
+    return {
+        "Activo Circulante detalle": {k: bal.get(k,0) for k in ["Caja","Bancos","Inversiones temporales", "Mercancías", "Inventario o almacén", "Clientes", "Documentos por cobrar", "Deudores diversos", "Anticipo a proveedores"]},
+        "Activo No Circulante detalle": {k: bal.get(k,0) for k in ["Terrenos","Edificios","Mobiliario","Equipo de computo electrónico", "Equipo de entrega o reparto", "Depositos en garantía", "Inversiones permanentes"]},
+        "Activo Diferido detalle": {k: bal.get(k,0) for k in ["Gastos de Inversión y Desarrollo", "Gastos en Etapas Prosperativas, de Organización y Administración","Gastos de Mercadotecnia","Gastos de instalación","Papeleria y útiles","Propaganda y Publicidad","Primas de seguros","Rentas Pagadas por Anticipado","Intereses Pagados por Anticipado"]},
+        "Pasivo Corto detalle": {k: bal.get(k,0) for k in ["Proveedores","Acreedores diversos","Documentos por pagar","Anticipo de clientes","Gastos Pendientes de Pago, por Pagar o Acumulados","Impuestos Pendientes de Pago, por Pagar o Acumulados"]},
+        "Pasivo Largo detalle": {k: bal.get(k,0) for k in ["Hipotecas por pagar o Acreedores Hipotecarios","Documentos por Pagar a Largo Plazo","Cuentas por Pagar a Largo Plazo"]},
+        "Pasivo Diferido detalle": {k: bal.get(k,0) for k in ["Rentas Cobradas por Anticipado","Intereses Cobrados por Anticipado"]},
+        "totales": {
+            "Total Activos": total_activos,
+            "Total Pasivos": total_pasivos,
+            "Capital Contable": total_activos - total_pasivos 
+        }
+    }
+
+# ---------- Consolidación de entidades ----------
+# Claves del ER guardado que se capturan con otro nombre en las secciones
+ER_CLAVES_GUARDADAS = {
+    "Impuesto  sobre la renta ISR": "ISR",
+    "Participacion de los trabajadores en las utilidades": "PTU",
+    "perdida entre otros gastos y productos": "perdida_entre_otros",
+}
+ER_ENTRADAS = ["Ventas totales", "devoluciones sobre ventas", "descuentos sobre ventas",
+               "inventario inicial", "compras", "gastos de compra", "devoluciones sobre compras",
+               "descuentos sobre compras", "inventario final",
+               "Intereses cobrados", "ganancia en cambios", "intereses pagados", "perdida en cambios",
+               "Impuesto  sobre la renta ISR", "Participacion de los trabajadores en las utilidades",
+               "perdida entre otros gastos y productos"]
+# Cuentas del Balance que los archivos guardados antes nombraban distinto a la captura
+BALANCE_CLAVES_ANTERIORES = {
+    "Inversiones Temporales": "Inversiones temporales", "Inventario o Almacén": "Inventario o almacén",
+    "Documentos por Cobrar": "Documentos por cobrar", "Deudores Diversos": "Deudores diversos",
+    "Anticipo a Proveedores": "Anticipo a proveedores", "Mobiliario y equipo": "Mobiliario",
+    "Equipo de computo": "Equipo de computo electrónico", "Equipo de Entrega o Reparto": "Equipo de entrega o reparto",
+    "Dépositos en Garantía": "Depositos en garantía", "Inversiones Permanentes": "Inversiones permanentes",
+    "Gastos de Instalación": "Gastos de instalación", "Papelería y Útiles": "Papeleria y útiles",
+    "Primas de Seguros": "Primas de seguros", "Anticipo de Clientes": "Anticipo de clientes",
+}
+CONSOLIDACION_MIN_PARALELO = 2000   # entidades a partir de las cuales se reparte entre procesos
+
+def valores_de_estado(estado):
+    """Recupera los valores capturados (claves de er_values) de un ER ya calculado."""
+    vals = {}
+    for v in estado.values():
+        if isinstance(v, dict):
+            vals.update(v)
+    for k in ER_ENTRADAS:
+        origen = ER_CLAVES_GUARDADAS.get(k, k)
+        if origen in estado:
+            vals[k] = estado[origen]
+    # productos/gastos financieros sólo se guardan sumados; se conservan en las cuentas de intereses
+    if "Intereses cobrados" not in vals and "productos_financieros" in estado:
+        vals["Intereses cobrados"] = estado["productos_financieros"]
+    if "intereses pagados" not in vals and "gastos_financieros" in estado:
+        vals["intereses pagados"] = estado["gastos_financieros"]
+    return vals
+
+def valores_de_balance(balance):
+    """Recupera las cuentas de detalle de un Balance ya calculado (acepta los nombres anteriores)."""
+    vals = {}
+    for k, v in balance.items():
+        if k != "totales" and isinstance(v, dict):
+            for cuenta, monto in v.items():
+                vals[BALANCE_CLAVES_ANTERIORES.get(cuenta, cuenta)] = monto
+    return vals
+
+CUENTAS_ER = frozenset(valores_de_estado(calcular_estado_resultados({})))
+CUENTAS_BALANCE = frozenset(valores_de_balance(calcular_balance({})))
+CAPITAL_ELIMINACION = "Capital Contable"   # contrapartida de "Inversiones permanentes"
+
+def estado_de_eliminacion(e):
+    """Estado ("estado_resultados" o "balance") al que pertenecen las dos cuentas de una eliminación."""
+    origen, destino = e.get("cuenta_origen"), e.get("cuenta_destino")
+    if origen in CUENTAS_ER and destino in CUENTAS_ER:
+        return "estado_resultados"
+    if origen in CUENTAS_BALANCE and (destino in CUENTAS_BALANCE or
+                                      (origen == "Inversiones permanentes" and destino == CAPITAL_ELIMINACION)):
+        return "balance"
+    raise ValueError(f"Eliminación con cuentas desconocidas o de estados distintos: {origen!r} / {destino!r}")
+
+def participacion_efectiva(entidades, tabla):
+    """Participación efectiva del grupo en cada entidad, recorriendo el árbol de tenencia.
+
+    `tabla` es {id: {"padre": id o None, "participacion": fracción que el padre posee}}.
+    Las entidades que no aparecen en la tabla se consideran 100% del grupo.
+    """
+    efectiva = {}
+    for ent in entidades:
+        ruta = []
+        nodo = ent
+        # subir hasta una entidad ya resuelta o a la raíz (iterativo: árboles profundos)
+        while nodo is not None and nodo not in efectiva and nodo not in ruta:
+            ruta.append(nodo)
+            nodo = tabla.get(nodo, {}).get("padre")
+        base = efectiva.get(nodo, 1.0)
+        for n in reversed(ruta):
+            base = base * float(tabla.get(n, {}).get("participacion", 1.0))
+            efectiva[n] = base
+    return efectiva
+
+def _reducir_bloque(args):
+    """Suma un bloque de entidades sobre el catálogo: total y parte no controladora."""
+    filas, catalogo, participaciones = args
+    m = np.zeros((len(filas), len(catalogo)))
+    for i, vals in enumerate(filas):
+        for k, v in vals.items():
+            j = catalogo.get(k)
+            if j is not None:
+                m[i, j] = v
+    return m.sum(axis=0), m.T @ (1.0 - np.asarray(participaciones, dtype=float))
+
+def _reducir(filas, participaciones, procesos=None):
+    """Reduce las entidades a un vector por cuenta; reparte en procesos si son muchas."""
+    catalogo = {}
+    for vals in filas:
+        for k in vals:
+            if k not in catalogo:
+                catalogo[k] = len(catalogo)
+    if procesos is None:
+        procesos = os.cpu_count() if len(filas) >= CONSOLIDACION_MIN_PARALELO else 1
+    if procesos <= 1 or len(filas) < 2:
+        return (catalogo,) + _reducir_bloque((filas, catalogo, participaciones))
+    tam = -(-len(filas) // procesos)
+    bloques = [(filas[i:i + tam], catalogo, participaciones[i:i + tam]) for i in range(0, len(filas), tam)]
+    total = np.zeros(len(catalogo))
+    minoritario = np.zeros(len(catalogo))
+    with ProcessPoolExecutor(max_workers=procesos) as ex:
+        for parcial, parcial_min in ex.map(_reducir_bloque, bloques):
+            total += parcial
+            minoritario += parcial_min
+    return catalogo, total, minoritario
+
+def consolidar(entidades, tabla=None, procesos=None, tipos_cambio=None, fecha=None):
+    """Consolida los estados de varias entidades en uno solo.
+
+    `entidades` es {id: datos}, con `datos` en el formato que escribe save_file.
+    `tabla` (opcional) trae {"entidades": árbol de tenencia, "eliminaciones": [...]}, donde
+    cada eliminación es {"origen", "cuenta_origen", "destino", "cuenta_destino", "monto"}
+    (p. ej. Clientes de A contra Proveedores de B). Ambas cuentas deben ser del mismo
+    estado (ER o Balance); una cuenta desconocida o un par mixto lanza ValueError. Para
+    eliminar la inversión de la tenedora contra el capital de la subsidiaria use
+    "Inversiones permanentes" contra "Capital Contable": se resta sólo de la inversión, y
+    el capital consolidado baja en el mismo monto. Sólo se eliminan operaciones entre
+    miembros del grupo. Con `tipos_cambio` las entidades en moneda extranjera se
+    convierten antes a pesos (ver convertir_entidades). Devuelve un diccionario con el
+    mismo formato de save_file.
+    """
+    tabla = tabla or {}
+    if tipos_cambio is not None:
+        entidades = convertir_entidades(entidades, tipos_cambio, fecha)
+    ids = list(entidades)
+    efectiva = participacion_efectiva(ids, tabla.get("entidades", {}))
+    eliminaciones = {"estado_resultados": [], "balance": []}
+    for e in tabla.get("eliminaciones", []):
+        clave = estado_de_eliminacion(e)
+        if e.get("origen") in entidades and e.get("destino") in entidades:
+            eliminaciones[clave].append(e)
+
+    resultado = {"entidades_consolidadas": len(ids), "eliminaciones_aplicadas": 0}
+    for clave, extraer, calcular in (("estado_resultados", valores_de_estado, calcular_estado_resultados),
+                                     ("balance", valores_de_balance, calcular_balance)):
+        con_estado = [i for i in ids if clave in entidades[i]]
+        if not con_estado:
+            continue
+        filas = [extraer(entidades[i][clave]) for i in con_estado]
+        part = [efectiva.get(i, 1.0) for i in con_estado]
+        catalogo, total, minoritario = _reducir(filas, part, procesos)
+        vals = {k: float(total[j]) for k, j in catalogo.items()}
+        for e in eliminaciones[clave]:
+            monto = to_float(e.get("monto"))
+            for cuenta in (e["cuenta_origen"], e["cuenta_destino"]):
+                if cuenta != CAPITAL_ELIMINACION:   # el capital baja al restar la inversión
+                    vals[cuenta] = vals.get(cuenta, 0.0) - monto
+        resultado["eliminaciones_aplicadas"] += len(eliminaciones[clave])
+        estado = calcular(vals)
+        # interés minoritario: parte no controladora de cada resultado/capital
+        minoritario = {k: float(minoritario[j]) for k, j in catalogo.items()}
+        if clave == "estado_resultados":
+            un_min = calcular(minoritario)["utilidad_neta"]
+            estado["utilidad_neta_interes_minoritario"] = un_min
+            estado["utilidad_neta_participacion_controladora"] = estado["utilidad_neta"] - un_min
+        else:
+            cap_min = calcular(minoritario)["totales"]["Capital Contable"]
+            estado["totales"]["Interés minoritario"] = cap_min
+            estado["totales"]["Capital Contable participación controladora"] = estado["totales"]["Capital Contable"] - cap_min
+            if tipos_cambio is not None:
+                estado["totales"]["Efecto por conversión"] = sum(
+                    entidades[i]["balance"]["totales"].get("Efecto por conversión", 0) for i in con_estado)
+        resultado[clave] = estado
+    return resultado
+
+# ---------- Estado de Flujo de Efectivo (método indirecto) ----------
+EFECTIVO = ["Caja", "Bancos"]
+# orden de las secciones en el vector que se guarda por periodo
+FLUJO_SECCIONES = ["efectivo", "activo circulante", "activo no circulante", "activo diferido",
+                   "pasivo corto", "pasivo largo", "pasivo diferido", "capital"]
+
+def secciones_balance(balance):
+    """Totales por sección de un balance, con el efectivo separado del activo circulante."""
+    def total(seccion, excluir=()):
+        return sum(v for k, v in balance.get(seccion, {}).items() if k not in excluir)
+    circ = balance.get("Activo Circulante detalle", {})
+    return np.array([
+        sum(circ.get(k, 0) for k in EFECTIVO),
+        total("Activo Circulante detalle", EFECTIVO),
+        total("Activo No Circulante detalle"),
+        total("Activo Diferido detalle"),
+        total("Pasivo Corto detalle"),
+        total("Pasivo Largo detalle"),
+        total("Pasivo Diferido detalle"),
+        balance.get("totales", {}).get("Capital Contable", 0),
+    ], dtype=float)
+
+def flujo_de_variaciones(delta, utilidad_neta, efectivo_inicial=0.0, depreciacion=0.0):
+    """Arma el flujo de efectivo a partir de las variaciones por sección entre dos balances.
+
+    La depreciación no usa efectivo: se suma en operación y se descuenta de la baja del
+    activo no circulante, para que la inversión refleje sólo compras y ventas de activos.
+    """
+    d = {k: float(v) for k, v in zip(FLUJO_SECCIONES, delta)}
+    utilidad_neta = float(utilidad_neta)
+    depreciacion = float(depreciacion)
+    operacion = (utilidad_neta + depreciacion - d["activo circulante"] - d["activo diferido"]
+                 + d["pasivo corto"] + d["pasivo diferido"])
+    inversion = -d["activo no circulante"] - depreciacion
+    financiamiento = d["pasivo largo"] + (d["capital"] - utilidad_neta)
+    neto = operacion + inversion + financiamiento
+    flujo = {
+        "utilidad_neta": utilidad_neta,
+        "depreciación del ejercicio": depreciacion,
+        "variación activo circulante (sin efectivo)": -d["activo circulante"],
+        "variación activo diferido": -d["activo diferido"],
+        "variación pasivo a corto plazo": d["pasivo corto"],
+        "variación pasivo diferido": d["pasivo diferido"],
+        "flujo de operación": operacion,
+        "adquisiciones netas de activo no circulante": inversion,
+        "flujo de inversión": inversion,
+        "variación pasivo a largo plazo": d["pasivo largo"],
+        "variación capital (sin utilidad del periodo)": d["capital"] - utilidad_neta,
+        "flujo de financiamiento": financiamiento,
+        "flujo neto de efectivo": neto,
+        "efectivo inicial": efectivo_inicial,
+        "efectivo final": efectivo_inicial + neto,
+    }
+    return {k: v + 0.0 for k, v in flujo.items()}   # evita mostrar -0.00
+
+def calcular_flujo_efectivo(balance_anterior, balance_actual, utilidad_neta, depreciacion=0.0):
+    """Flujo de efectivo de un periodo a partir de dos balances consecutivos y su utilidad neta."""
+    anterior = secciones_balance(balance_anterior)
+    delta = secciones_balance(balance_actual) - anterior
+    return flujo_de_variaciones(delta, utilidad_neta, float(anterior[0]), depreciacion)
+
+def depreciacion_de_estado(estado):
+    """Depreciación del ejercicio registrada en los gastos de administración de un ER."""
+    return estado.get("gastos de administracion detalle", {}).get("depreciacion del ejercicio", 0)
+
+def periodo_de_datos(datos, origen=""):
+    """Periodo de un archivo guardado, tomado de su campo "periodo" o "fecha" (AAAA-MM[-DD])."""
+    valor = datos.get("periodo", datos.get("fecha"))
+    if not valor:
+        raise ValueError(f"El archivo no indica 'periodo' ni 'fecha':\n{origen}")
+    try:
+        return pd.Timestamp(str(valor))
+    except ValueError:
+        raise ValueError(f"Periodo inválido '{valor}':\n{origen}") from None
+
+class FlujoEfectivo:
+    """Serie de flujos de efectivo que se actualiza periodo a periodo.
+
+    Guarda los totales por sección y las variaciones ya calculadas de cada periodo,
+    así que agregar un mes sólo calcula la diferencia contra el balance anterior.
+    """
+    def __init__(self):
+        self.periodos = []
+        self.secciones = []     # vector de secciones de cada balance
+        self.variaciones = []   # variación de cada periodo contra el anterior
+        self.flujos = []        # flujo de cada periodo (a partir del segundo)
+
+    def agregar(self, periodo, balance, utilidad_neta=0.0, depreciacion=0.0):
+        """Agrega el balance de un periodo; devuelve su flujo (None para el primero).
+
+        Los periodos deben llegar en orden estrictamente creciente.
+        """
+        if self.periodos and not periodo > self.periodos[-1]:
+            raise ValueError(f"El periodo {periodo} no es posterior a {self.periodos[-1]}")
+        sec = secciones_balance(balance)
+        flujo = None
+        if self.secciones:
+            delta = sec - self.secciones[-1]
+            flujo = flujo_de_variaciones(delta, utilidad_neta, float(self.secciones[-1][0]), depreciacion)
+            self.variaciones.append(delta)
+            self.flujos.append(flujo)
+        self.periodos.append(periodo)
+        self.secciones.append(sec)
+        return flujo
+
+    def truncar(self, n):
+        """Conserva sólo los primeros `n` periodos (p. ej. si cambió un archivo intermedio)."""
+        del self.periodos[n:]
+        del self.secciones[n:]
+        del self.variaciones[max(n - 1, 0):]
+        del self.flujos[max(n - 1, 0):]
+
+# ---------- Simulación de escenarios (Monte Carlo) ----------
+SIMULACION_BLOQUE = 1_000_000         # escenarios por bloque, para acotar la memoria
+SIMULACION_MIN_PARALELO = 4_000_000   # escenarios a partir de los cuales se reparte entre procesos
+ER_GASTOS_OPERACION = ["Renta de almacen", "Propaganda y publicidad", "Sueldos de agentes y dependeientes",
+                       "comisiones de agentes y dependientes", "consumo de luz del almacen",
+                       "Renta de oficinas", "sueldos del personal de oficinas", "papeleria y utiles",
+                       "consumo de luz de oficinas", "depreciacion del ejercicio"]
+
+def muestrear(dist, n, rng):
+    """Genera `n` valores de una distribución.
+
+    `dist` es ("normal", media, desviación), ("triangular", mínimo, moda, máximo)
+    o ("historico", valores observados) para remuestreo con reemplazo.
+    """
+    tipo = dist[0]
+    if tipo == "normal":
+        return rng.normal(dist[1], dist[2], n)
+    if tipo == "triangular":
+        return rng.triangular(dist[1], dist[2], dist[3], n)
+    if tipo == "historico":
+        return rng.choice(np.asarray(dist[1], dtype=float), n)
+    raise ValueError(f"Distribución desconocida: {tipo}")
+
+def _simular_bloque(args):
+    """Calcula la utilidad neta de un bloque de escenarios en una sola pasada vectorizada."""
+    base, distribuciones, n, semilla = args
+    rng = np.random.default_rng(semilla)
+    vals = dict(base)
+    for k, dist in distribuciones.items():
+        vals[k] = muestrear(dist, n, rng)
+    un = calcular_estado_resultados(vals)["utilidad_neta"]
+    return np.broadcast_to(np.asarray(un, dtype=float), (n,))
+
+def simular_escenarios(base, distribuciones, n=1_000_000, semilla=None, procesos=None,
+                       percentiles=(5, 25, 50, 75, 95)):
+    """Distribución de la utilidad neta cuando varían las cuentas del ER.
+
+    `base` son los valores capturados (claves de er_values); `distribuciones` indica
+    {cuenta: distribución} para las cuentas que varían (ver `muestrear`). Los escenarios
+    se procesan en bloques con las mismas fórmulas que calcular_estado_resultados.
+    """
+    tamanos = [min(SIMULACION_BLOQUE, n - i) for i in range(0, n, SIMULACION_BLOQUE)]
+    semillas = np.random.SeedSequence(semilla).spawn(len(tamanos))
+    bloques = [(base, distribuciones, t, s) for t, s in zip(tamanos, semillas)]
+    if procesos is None:
+        procesos = os.cpu_count() if n >= SIMULACION_MIN_PARALELO else 1
+    if procesos > 1 and len(bloques) > 1:
+        with ProcessPoolExecutor(max_workers=procesos) as ex:
+            resultados = list(ex.map(_simular_bloque, bloques))
+    else:
+        resultados = [_simular_bloque(b) for b in bloques]
+    un = np.concatenate(resultados)
+    return {
+        "escenarios": n,
+        "media": float(un.mean()),
+        "desviacion": float(un.std()),
+        "percentiles": {f"P{p}": float(v) for p, v in zip(percentiles, np.percentile(un, percentiles))},
+        "probabilidad_perdida": float((un < 0).mean()),
+    }
+
+# ---------- Costeo de inventarios (PEPS / UEPS / costo promedio) ----------
+METODOS_INVENTARIO = ("PEPS", "UEPS", "PROMEDIO")
+
+class CapasCosto:
+    """Capas de costo de un SKU en arreglos compactos: cola para PEPS, pila para UEPS."""
+    __slots__ = ("cantidades", "costos", "inicio", "ueps")
+
+    def __init__(self, ueps=False):
+        self.cantidades = array("d")
+        self.costos = array("d")
+        self.inicio = 0          # primera capa viva (las anteriores ya se consumieron)
+        self.ueps = ueps
+
+    def entrada(self, cantidad, costo_unitario):
+        self.cantidades.append(cantidad)
+        self.costos.append(costo_unitario)
+
+    def salida(self, cantidad):
+        """Consume `cantidad` de las capas y devuelve su costo."""
+        c, u = self.cantidades, self.costos
+        costo = 0.0
+        while cantidad > 1e-9 and len(c) > self.inicio:
+            i = len(c) - 1 if self.ueps else self.inicio
+            toma = min(cantidad, c[i])
+            costo += toma * u[i]
+            cantidad -= toma
+            c[i] -= toma
+            if c[i] <= 1e-9:
+                if self.ueps:
+                    c.pop(); u.pop()
+                else:
+                    self.inicio += 1
+        if cantidad > 1e-9:
+            raise ValueError(f"Salida mayor a la existencia por {cantidad:,.2f} unidades")
+        # compactar la cola cuando la mayor parte ya se consumió
+        if self.inicio > 64 and 2 * self.inicio > len(c):
+            del c[:self.inicio]
+            del u[:self.inicio]
+            self.inicio = 0
+        return costo
+
+    def valor(self):
+        return sum(self.cantidades[i] * self.costos[i] for i in range(self.inicio, len(self.cantidades)))
+
+class CostoPromedio:
+    """Existencia y valor de un SKU valuados a costo promedio ponderado."""
+    __slots__ = ("cantidad", "importe")
+
+    def __init__(self):
+        self.cantidad = 0.0
+        self.importe = 0.0
+
+    def entrada(self, cantidad, costo_unitario):
+        self.cantidad += cantidad
+        self.importe += cantidad * costo_unitario
+
+    def salida(self, cantidad):
+        if cantidad > self.cantidad + 1e-9:
+            raise ValueError(f"Salida mayor a la existencia por {cantidad - self.cantidad:,.2f} unidades")
+        costo = self.importe * cantidad / self.cantidad if self.cantidad else 0.0
+        self.cantidad -= cantidad
+        self.importe -= costo
+        return costo
+
+    def valor(self):
+        return self.importe
+
+def leer_movimientos(ruta):
+    """Lee movimientos de un CSV (sku, tipo, cantidad, costo_unitario) sin cargarlo completo.
+
+    `tipo` es "inicial" (existencia al inicio del periodo), "entrada" o "salida";
+    las filas deben venir en orden cronológico.
+    """
+    with open(ruta, "r", encoding="utf-8", newline="") as fp:
+        for fila in csv.DictReader(fp):
+            yield fila["sku"], fila["tipo"].strip().lower(), to_float(fila["cantidad"]), to_float(fila.get("costo_unitario"))
+
+def costear_inventario(movimientos, metodo="PEPS"):
+    """Valúa el inventario con PEPS, UEPS o costo promedio.
+
+    Devuelve los importes que usa el ER: inventario inicial, compras (entradas),
+    costo de lo vendido (salidas) e inventario final.
+    """
+    metodo = metodo.upper()
+    if metodo not in METODOS_INVENTARIO:
+        raise ValueError(f"Método de costeo desconocido: {metodo}")
+    if metodo == "PROMEDIO":
+        nuevo = CostoPromedio
+    else:
+        ueps = metodo == "UEPS"
+        nuevo = lambda: CapasCosto(ueps)
+    skus = {}
+    inicial = compras = costo_vendido = 0.0
+    for n, (sku, tipo, cantidad, costo) in enumerate(movimientos, 1):
+        capas = skus.get(sku)
+        if capas is None:
+            capas = skus[sku] = nuevo()
+        if tipo == "salida":
+            try:
+                costo_vendido += capas.salida(cantidad)
+            except ValueError as e:
+                raise ValueError(f"Movimiento {n} (SKU {sku}): {e}") from None
+        elif tipo in ("entrada", "inicial"):
+            capas.entrada(cantidad, costo)
+            if tipo == "inicial":
+                inicial += cantidad * costo
+            else:
+                compras += cantidad * costo
+        else:
+            raise ValueError(f"Movimiento {n} (SKU {sku}): tipo desconocido '{tipo}'")
+    return {
+        "inventario inicial": inicial,
+        "compras": compras,
+        "costo de lo vendido": costo_vendido,
+        "inventario final": sum(c.valor() for c in skus.values()),
+        "skus": len(skus),
+    }
+
+# ---------- Activo fijo y depreciación ----------
+# Cuentas del Activo No Circulante que se alimentan desde el registro de activos
+CATEGORIAS_ACTIVO = ["Edificios", "Mobiliario", "Equipo de computo electrónico", "Equipo de entrega o reparto"]
+METODOS_DEPRECIACION = {"linea_recta": 0, "saldo_decreciente": 1}
+ACTIVO_DTYPE = np.dtype([("mes", "i4"), ("costo", "f8"), ("vida", "i4"), ("metodo", "i1"),
+                         ("residual", "f8"), ("categoria", "i1"), ("baja", "i4")])
+SIN_BAJA = np.iinfo("i4").max
+ACTIVOS_BLOQUE = 8192   # activos por bloque al recalcular todo el registro
+
+def mes_de_fecha(fecha):
+    """Convierte 'AAAA-MM' o 'AAAA-MM-DD' a un número de mes consecutivo."""
+    anio, mes = str(fecha).strip()[:7].split("-")
+    return int(anio) * 12 + int(mes) - 1
+
+def _valor_en_libros(activos, edad):
+    """Valor en libros de cada activo tras `edad` meses depreciándose (matriz activos x meses).
+
+    El saldo decreciente cambia a línea recta sobre la vida restante en el primer mes
+    en que ésta deprecia al menos lo mismo que la tasa doble.
+    """
+    costo = activos["costo"][:, None]
+    residual = activos["residual"][:, None]
+    vida = np.maximum(activos["vida"], 1)[:, None]
+    k = np.clip(edad, 0, vida)
+    recta = costo - (costo - residual) * k / vida
+    tasa = np.minimum(2.0 / vida, 1.0)
+    # mes del cambio: primer j con cargo de línea recta (saldo - residual) / (vida - j) >= tasa * saldo
+    j = np.arange(int(vida.max()) + 1)[None, :]
+    saldo = costo * (1 - tasa) ** j
+    cambio = np.argmax((tasa * saldo * (vida - j) <= saldo - residual) | (j >= vida), axis=1)[:, None]
+    saldo_cambio = np.maximum(costo * (1 - tasa) ** cambio, residual)
+    restante = np.maximum(vida - cambio, 1)
+    decreciente = np.where(k <= cambio, np.maximum(costo * (1 - tasa) ** k, residual),
+                           saldo_cambio - (saldo_cambio - residual) * (k - cambio) / restante)
+    decreciente = np.where(k >= vida, residual, decreciente)
+    return np.where(activos["metodo"][:, None] == 1, decreciente, recta)
+
+def calendario_depreciacion(activos, mes_inicio, meses):
+    """Depreciación mensual y valor neto de cada activo para `meses` meses desde `mes_inicio`.
+
+    Devuelve dos matrices (activos x meses). La depreciación empieza el mes siguiente
+    a la adquisición; el saldo decreciente usa tasa doble (2 / vida), cambia a línea
+    recta cuando ésta deprecia más y nunca baja del valor residual, que se alcanza al
+    terminar la vida útil. Los activos dados de baja
+    dejan de depreciarse y de sumar valor neto a partir del mes de la baja.
+    """
+    m = mes_inicio + np.arange(meses)[None, :]
+    edad = m - activos["mes"][:, None]
+    libros = _valor_en_libros(activos, edad)
+    en_servicio = (edad >= 0) & (m < activos["baja"][:, None])
+    dep = np.where(en_servicio, _valor_en_libros(activos, edad - 1) - libros, 0.0)
+    neto = np.where(en_servicio, libros, 0.0)
+    return dep, neto
+
+class RegistroActivos:
+    """Registro de activos fijos en un arreglo estructurado compacto.
+
+    Mantiene la depreciación y el valor neto por categoría para un horizonte de meses;
+    al agregar o dar de baja un activo sólo se recalcula el calendario de ese activo.
+    """
+    def __init__(self, mes_inicio, meses):
+        self.mes_inicio = mes_inicio
+        self.meses = meses
+        self.activos = np.zeros(64, dtype=ACTIVO_DTYPE)
+        self.n = 0
+        self.dep = np.zeros((len(CATEGORIAS_ACTIVO), meses))
+        self.neto = np.zeros((len(CATEGORIAS_ACTIVO), meses))
+
+    def _acumular(self, inicio, fin, signo=1.0):
+        """Suma (o resta) el calendario de los activos [inicio, fin) a los totales por categoría."""
+        for a in range(inicio, fin, ACTIVOS_BLOQUE):
+            bloque = self.activos[a:min(a + ACTIVOS_BLOQUE, fin)]
+            dep, neto = calendario_depreciacion(bloque, self.mes_inicio, self.meses)
+            np.add.at(self.dep, bloque["categoria"], signo * dep)
+            np.add.at(self.neto, bloque["categoria"], signo * neto)
+
+    def _reservar(self, n):
+        if self.n + n > len(self.activos):
+            nuevo = np.zeros(max(2 * len(self.activos), self.n + n), dtype=ACTIVO_DTYPE)
+            nuevo[:self.n] = self.activos[:self.n]
+            self.activos = nuevo
+
+    def agregar(self, categoria, fecha, costo, vida_meses, metodo="linea_recta", residual=0.0):
+        """Agrega un activo y devuelve su índice en el registro."""
+        self._reservar(1)
+        i = self.n
+        self.activos[i] = (mes_de_fecha(fecha), costo, vida_meses, METODOS_DEPRECIACION[metodo],
+                           residual, CATEGORIAS_ACTIVO.index(categoria), SIN_BAJA)
+        self.n += 1
+        self._acumular(i, i + 1)
+        return i
+
+    def baja(self, i, fecha):
+        """Da de baja el activo `i` a partir del mes de `fecha`."""
+        self._acumular(i, i + 1, -1.0)
+        self.activos[i]["baja"] = mes_de_fecha(fecha)
+        self._acumular(i, i + 1)
+
+    def cargar_csv(self, ruta):
+        """Carga activos de un CSV (categoria, fecha_adquisicion, costo, vida_util_meses, metodo, valor_residual)."""
+        df = pd.read_csv(ruta, dtype={"categoria": str, "metodo": str})
+        self._reservar(len(df))
+        inicio = self.n
+        nuevos = self.activos[inicio:inicio + len(df)]
+        nuevos["mes"] = [mes_de_fecha(f) for f in df["fecha_adquisicion"]]
+        nuevos["costo"] = df["costo"].to_numpy(float)
+        nuevos["vida"] = df["vida_util_meses"].to_numpy(int)
+        metodo = df["metodo"] if "metodo" in df else pd.Series("linea_recta", index=df.index)
+        codigos = metodo.fillna("linea_recta").map(METODOS_DEPRECIACION)
+        if codigos.isna().any():
+            raise ValueError(f"Método de depreciación desconocido: {metodo[codigos.isna()].iloc[0]}")
+        nuevos["metodo"] = codigos.to_numpy(int)
+        nuevos["residual"] = df["valor_residual"].fillna(0).to_numpy(float) if "valor_residual" in df else 0.0
+        categoria = df["categoria"].map({c: i for i, c in enumerate(CATEGORIAS_ACTIVO)})
+        if categoria.isna().any():
+            raise ValueError(f"Categoría desconocida: {df['categoria'][categoria.isna()].iloc[0]}")
+        nuevos["categoria"] = categoria.to_numpy(int)
+        nuevos["baja"] = SIN_BAJA
+        self.n += len(df)
+        self._acumular(inicio, self.n)
+
+    def resumen(self, fecha):
+        """Valor neto por categoría al cierre de `fecha` y depreciación del ejercicio hasta ese mes."""
+        m = mes_de_fecha(fecha) - self.mes_inicio
+        if not 0 <= m < self.meses:
+            raise ValueError(f"La fecha {fecha} está fuera del horizonte del registro")
+        inicio_anio = max(m - (m + self.mes_inicio) % 12, 0)
+        return {
+            "valor neto": {c: float(self.neto[i, m]) for i, c in enumerate(CATEGORIAS_ACTIVO)},
+            "depreciacion del ejercicio": float(self.dep[:, inicio_anio:m + 1].sum()),
+            "activos": int(self.n),
+        }
+
+# ---------- PTU (participación de los trabajadores en las utilidades) ----------
+TASA_PTU = 0.10          # porcentaje de la utilidad que se reparte
+PTU_TOPE_MESES = 3       # tope por trabajador: meses de salario (o el promedio de los últimos 3 años)
+PLANTILLA_BLOQUE = 100_000
+
+def leer_plantilla(ruta):
+    """Lee la plantilla de un CSV por bloques.
+
+    Columnas: empleado, dias_trabajados, salario_anual y, opcional, promedio_ptu_3_anios.
+    Devuelve los identificadores y arreglos de días, salarios y promedios.
+    """
+    ids, dias, salarios, promedios = [], [], [], []
+    for df in pd.read_csv(ruta, chunksize=PLANTILLA_BLOQUE, dtype={"empleado": str}):
+        ids.append(df["empleado"].to_numpy())
+        dias.append(df["dias_trabajados"].to_numpy(float))
+        salarios.append(df["salario_anual"].to_numpy(float))
+        if "promedio_ptu_3_anios" in df:
+            promedios.append(df["promedio_ptu_3_anios"].fillna(0).to_numpy(float))
+        else:
+            promedios.append(np.zeros(len(df)))
+    if not ids:
+        return np.array([], dtype=object), np.zeros(0), np.zeros(0), np.zeros(0)
+    return np.concatenate(ids), np.concatenate(dias), np.concatenate(salarios), np.concatenate(promedios)
+
+def calcular_ptu(utilidad_antes_isr_ptu, dias, salarios, promedio_ptu=None, tasa=TASA_PTU):
+    """Reparte la PTU entre los trabajadores: mitad por días trabajados y mitad por salario.
+
+    Cada monto se limita al mayor entre `PTU_TOPE_MESES` meses de salario y el promedio
+    de PTU recibida en los últimos tres años; lo que exceda los topes no se reparte.
+    """
+    dias = np.asarray(dias, dtype=float)
+    salarios = np.asarray(salarios, dtype=float)
+    base = max(float(utilidad_antes_isr_ptu), 0.0) * tasa
+    mitad = base / 2
+    montos = np.zeros(len(dias))
+    if dias.sum() > 0:
+        montos += mitad * dias / dias.sum()
+    if salarios.sum() > 0:
+        montos += mitad * salarios / salarios.sum()
+    tope = salarios / 12 * PTU_TOPE_MESES
+    if promedio_ptu is not None:
+        tope = np.maximum(tope, np.asarray(promedio_ptu, dtype=float))
+    montos = np.minimum(montos, tope)
+    total = float(montos.sum())
+    return {"base": base, "montos": montos, "total": total, "no_repartido": base - total}
+
+# ---------- ISR por tablas ----------
+TABLAS_ISR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablas_isr")
+ISR_TASA_PERSONAS_MORALES = 0.30   # tasa fija opcional cuando no se usa tabla
+
+@functools.lru_cache(maxsize=None)
+def tabla_isr(anio, directorio=TABLAS_ISR_DIR, tasa_fija=None):
+    """Tabla de ISR de un ejercicio como arreglos ordenados (límites inferiores, cuotas fijas, tasas).
+
+    Se lee de `isr_<anio>.csv` (columnas limite_inferior, cuota_fija, tasa; la tasa puede
+    venir en porcentaje) y queda en caché por ejercicio. Si no existe el archivo se lanza
+    FileNotFoundError, salvo que se pida explícitamente una `tasa_fija` (p. ej.
+    ISR_TASA_PERSONAS_MORALES), que se usa entonces como tabla de un solo renglón.
+    """
+    ruta = os.path.join(directorio, f"isr_{anio}.csv")
+    if os.path.exists(ruta):
+        df = pd.read_csv(ruta).sort_values("limite_inferior")
+        if df.empty:
+            raise ValueError(f"La tabla de ISR {anio} no tiene renglones: {ruta}")
+        limites = df["limite_inferior"].to_numpy(float)
+        cuotas = df["cuota_fija"].to_numpy(float)
+        tasas = df["tasa"].to_numpy(float)
+        if (tasas > 1).any():
+            tasas = tasas / 100
+    elif tasa_fija is not None:
+        limites, cuotas, tasas = np.zeros(1), np.zeros(1), np.array([float(tasa_fija)])
+    else:
+        raise FileNotFoundError(f"No existe la tabla de ISR {anio}: {ruta}")
+    for a in (limites, cuotas, tasas):
+        a.setflags(write=False)   # compartidos por la caché
+    return limites, cuotas, tasas
+
+def calcular_isr(bases, anio, directorio=TABLAS_ISR_DIR, tasa_fija=None):
+    """ISR de un lote de bases gravables: busca el renglón de la tabla y aplica cuota + excedente x tasa."""
+    bases = np.asarray(bases, dtype=float)
+    limites, cuotas, tasas = tabla_isr(anio, directorio, tasa_fija)
+    i = np.clip(np.searchsorted(limites, bases, side="right") - 1, 0, len(limites) - 1)
+    isr = cuotas[i] + (bases - limites[i]) * tasas[i]
+    return np.where(bases > 0, isr, 0.0)
+
+def aplicar_isr(estados, anio, directorio=TABLAS_ISR_DIR, tasa_fija=None):
+    """Calcula el ISR de muchos Estados de Resultados en una sola llamada y actualiza su utilidad neta.
+
+    La base es la utilidad antes de ISR y PTU menos la PTU. Devuelve el arreglo de ISR.
+    """
+    antes = np.array([e.get("utilidad_antes_isr_ptu", 0) for e in estados], dtype=float)
+    ptu = np.array([e.get("PTU", 0) for e in estados], dtype=float)
+    isr = calcular_isr(antes - ptu, anio, directorio, tasa_fija)
+    neta = antes - isr - ptu
+    for e, i, n in zip(estados, isr.tolist(), neta.tolist()):
+        e["ISR"] = i
+        e["utilidad_neta"] = n
+    return isr
+
+# ---------- Exportación (PDF / Excel) ----------
+def generar_pdf(data, kind, destino):
+    """Genera el PDF del reporte `kind` ("estado", "balance" o "flujo") en una ruta o archivo binario."""
+    doc = SimpleDocTemplate(destino, pagesize=letter)
+    styles = getSampleStyleSheet()
+    story = []
+
+    # Logos on PDF header (if files exist)
+    if os.path.exists(LOGO_IPN_PATH):
+        try:
+            rl = RLImage(LOGO_IPN_PATH, width=3*cm, height=4*cm)
+            rl.hAlign = "LEFT"
+            story.append(rl)
+        except:
+            pass
+    if os.path.exists(LOGO_UPIIZ_PATH):
+        try:
+            rl2 = RLImage(LOGO_UPIIZ_PATH, width=2.5*cm, height=2.5*cm)
+            rl2.hAlign = "RIGHT"
+            story.append(rl2)
+        except:
+            pass
+
+    story.append(Spacer(1, 8))
+    story.append(Paragraph("PoliFin — Reporte Financiero", styles["Title"]))
+    story.append(Spacer(1, 12))
+
+    if kind == "estado":
+        vals = data.get("estado_resultados", {})
+        rows = [["Cuenta", "Monto"]]
+        order = ["Ventas totales","devoluciones sobre ventas","descuentos sobre ventas","ventas netas",
+                 "inventario inicial","compras","gastos de compra","compras totales","devoluciones sobre compras","descuentos sobre compras",
+                 "compras netas","suma o total de mercancías","inventario final","costo de lo vendido","utilidad bruta"]
+        for k in order:
+            rows.append([k, f"{vals.get(k,0):,.2f}"])
+        rows.append(["Gastos de operación", ""])
+        for k,v in vals.get("gastos de venta detalle",{}).items():
+            rows.append([f"  {k}", f"{v:,.2f}"])
+        for k,v in vals.get("gastos de administracion detalle",{}).items():
+            rows.append([f"  {k}", f"{v:,.2f}"])
+        rows.append(["Productos financieros", f"{vals.get('productos_financieros',0):,.2f}"])
+        rows.append(["Gastos financieros", f"{vals.get('gastos_financieros',0):,.2f}"])
+        rows.append(["Utilidad de operación", f"{vals.get('utilidad_operacion',0):,.2f}"])
+        rows.append(["Utilidad antes de ISR y PTU", f"{vals.get('utilidad_antes_isr_ptu',0):,.2f}"])
+        rows.append(["ISR", f"{vals.get('ISR',0):,.2f}"])
+        rows.append(["PTU", f"{vals.get('PTU',0):,.2f}"])
+        rows.append(["UTILIDAD NETA DEL EJERCICIO", f"{vals.get('utilidad_neta',0):,.2f}"])
+        t = Table(rows, colWidths=[360, 140])
+        t.setStyle(TableStyle([
+            ("GRID",(0,0),(-1,-1),0.3,colors.grey),
+            ("BACKGROUND",(0,0),(-1,0),colors.HexColor(GUINDA)),
+            ("TEXTCOLOR",(0,0),(-1,0),colors.white),
+            ("ALIGN",(1,1),(-1,-1),"RIGHT")
+        ]))
+        story.append(t)
+    elif kind == "flujo":
+        rows = [["Concepto", "Monto"]]
+        for k,v in data.get("flujo_efectivo",{}).items():
+            rows.append([k, f"{v:,.2f}"])
+        t = Table(rows, colWidths=[360,140])
+        t.setStyle(TableStyle([
+            ("GRID",(0,0),(-1,-1),0.3,colors.grey),
+            ("BACKGROUND",(0,0),(-1,0),colors.HexColor(GUINDA)),
+            ("TEXTCOLOR",(0,0),(-1,0),colors.white),
+            ("ALIGN",(1,1),(-1,-1),"RIGHT")
+        ]))
+        story.append(t)
+    else:
+        bal = data.get("balance", {})
+        rows = [["Cuenta", "Monto"]]
+        rows.append(["ACTIVOS", ""])
+        for k,v in bal.get("Activo Circulante detalle",{}).items():
+            rows.append([f"  {k}", f"{v:,.2f}"])
+        for k,v in bal.get("Activo No Circulante detalle",{}).items():
+            rows.append([f"  {k}", f"{v:,.2f}"])
+        for k,v in bal.get("Activo Diferido detalle",{}).items():
+            rows.append([f"  {k}", f"{v:,.2f}"])
+        rows.append(["TOTALES", ""])
+        for k,v in bal.get("totales",{}).items():
+            rows.append([k, f"{v:,.2f}"])
+        t = Table(rows, colWidths=[360,140])
+        t.setStyle(TableStyle([
+            ("GRID",(0,0),(-1,-1),0.3,colors.grey),
+            ("BACKGROUND",(0,0),(-1,0),colors.HexColor(GUINDA)),
+            ("TEXTCOLOR",(0,0),(-1,0),colors.white),
+            ("ALIGN",(1,1),(-1,-1),"RIGHT")
+        ]))
+        story.append(t)
+
+    doc.build(story)
+
+def generar_excel(data, kind, destino):
+    """Genera el Excel del reporte `kind` ("estado", "balance" o "flujo") en una ruta o archivo binario."""
+    if kind == "estado":
+        vals = data.get("estado_resultados", {})
+        rows = []
+        order = ["Ventas totales","devoluciones sobre ventas","descuentos sobre ventas","ventas netas",
+                 "inventario inicial","compras","gastos de compra","compras totales","devoluciones sobre compras","descuentos sobre compras",
+                 "compras netas","suma o total de mercancías","inventario final","costo de lo vendido","utilidad bruta"]
+        for k in order:
+            rows.append({"Cuenta":k, "Monto": vals.get(k,0)})
+        rows.append({"Cuenta":"Gastos de operación", "Monto": ""})
+        for k,v in vals.get("gastos de venta detalle",{}).items():
+            rows.append({"Cuenta":"   "+k, "Monto": v})
+        for k,v in vals.get("gastos de administracion detalle",{}).items():
+            rows.append({"Cuenta":"   "+k, "Monto": v})
+        rows.append({"Cuenta":"Productos financieros", "Monto": vals.get("productos_financieros",0)})
+        rows.append({"Cuenta":"Gastos financieros", "Monto": vals.get("gastos_financieros",0)})
+        rows.append({"Cuenta":"Utilidad de operación", "Monto": vals.get("utilidad_operacion",0)})
+        rows.append({"Cuenta":"Utilidad antes de ISR y PTU", "Monto": vals.get("utilidad_antes_isr_ptu",0)})
+        rows.append({"Cuenta":"ISR", "Monto": vals.get("ISR",0)})
+        rows.append({"Cuenta":"PTU", "Monto": vals.get("PTU",0)})
+        rows.append({"Cuenta":"UTILIDAD NETA DEL EJERCICIO", "Monto": vals.get("utilidad_neta",0)})
+        df = pd.DataFrame(rows)
+        df.to_excel(destino, index=False, sheet_name="EstadoResultados")
+    elif kind == "balance":
+        bal = data.get("balance", {})
+        rows = []
+        rows.append({"Cuenta":"ACTIVOS", "Monto": ""})
+        for k,v in bal.get("Activo Circulante detalle",{}).items():
+            rows.append({"Cuenta":"  "+k, "Monto": v})
+        for k,v in bal.get("Activo No Circulante detalle",{}).items():
+            rows.append({"Cuenta":"  "+k, "Monto": v})
+        rows.append({"Cuenta":"TOTALES", "Monto": ""})
+        for k,v in bal.get("totales",{}).items():
+            rows.append({"Cuenta": k, "Monto": v})
+        df = pd.DataFrame(rows)
+        df.to_excel(destino, index=False, sheet_name="BalanceGeneral")
+    elif kind == "flujo":
+        rows = [{"Concepto": k, "Monto": v} for k,v in data.get("flujo_efectivo",{}).items()]
+        df = pd.DataFrame(rows)
+        df.to_excel(destino, index=False, sheet_name="FlujoEfectivo")
+    else:
+        raise ValueError(f"Reporte desconocido: {kind}")
+
+# ---------- Vigilancia de carpeta (modo daemon) ----------
+MANIFIESTO = ".polifin_manifiesto.json"
+MANIFIESTO_ERROR = "error:"   # prefijo del hash de un archivo que no se pudo procesar
+VIGILAR_INTERVALO = 2.0   # segundos entre revisiones de mtime cuando no hay inotify
+VIGILAR_ESPERA = 1.0      # segundos sin cambios antes de procesar una ráfaga
+
+def hash_archivo(ruta):
+    """SHA-256 del contenido de un archivo, leído por bloques."""
+    h = hashlib.sha256()
+    with open(ruta, "rb") as fp:
+        for bloque in iter(lambda: fp.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+def recalcular_datos(data):
+    """Recalcula el ER y el Balance de un archivo guardado a partir de sus cuentas capturadas."""
+    data = dict(data)
+    if "estado_resultados" in data:
+        data["estado_resultados"] = calcular_estado_resultados(valores_de_estado(data["estado_resultados"]))
+    if "balance" in data:
+        data["balance"] = calcular_balance(valores_de_balance(data["balance"]))
+    return data
+
+def regenerar_reportes(ruta, salida):
+    """Recalcula un archivo JSON y escribe sus reportes en PDF y Excel; devuelve las rutas creadas."""
+    with open(ruta, "r", encoding="utf-8") as fp:
+        data = recalcular_datos(json.load(fp))
+    nombre = os.path.splitext(os.path.basename(ruta))[0]
+    creados = []
+    for kind, clave in (("estado", "estado_resultados"), ("balance", "balance"), ("flujo", "flujo_efectivo")):
+        if clave not in data:
+            continue
+        for ext, generar in (("pdf", generar_pdf), ("xlsx", generar_excel)):
+            destino = os.path.join(salida, f"{nombre}_{kind}.{ext}")
+            generar(data, kind, destino)
+            creados.append(destino)
+    return creados
+
+class VigilanteCarpeta:
+    """Regenera los reportes de los JSON que cambian en una carpeta.
+
+    Usa inotify si está disponible (bloquea sin consumir CPU) y, si no, revisa los mtime
+    cada `intervalo` segundos. Los cambios se agrupan hasta que pasan `espera` segundos
+    sin novedades, y sólo se procesan los archivos cuyo hash difiere del manifiesto.
+    """
+    def __init__(self, directorio, salida=None, intervalo=VIGILAR_INTERVALO, espera=VIGILAR_ESPERA):
+        self.directorio = os.path.abspath(directorio)
+        self.salida = salida or os.path.join(self.directorio, "reportes")
+        self.intervalo = intervalo
+        self.espera = espera
+        self.ruta_manifiesto = os.path.join(self.directorio, MANIFIESTO)
+        self.manifiesto = {}
+        if os.path.exists(self.ruta_manifiesto):
+            with open(self.ruta_manifiesto, "r", encoding="utf-8") as fp:
+                self.manifiesto = json.load(fp)
+        self.vistos = {}   # nombre -> (mtime_ns, tamaño) de la última revisión
+
+    def escanear(self):
+        """Nombres de los JSON cuyo mtime o tamaño cambió desde la revisión anterior."""
+        actuales = {}
+        with os.scandir(self.directorio) as it:
+            for e in it:
+                if e.is_file() and e.name.endswith(".json") and e.name != MANIFIESTO:
+                    st = e.stat()
+                    actuales[e.name] = (st.st_mtime_ns, st.st_size)
+        cambiados = {n for n, firma in actuales.items() if self.vistos.get(n) != firma}
+        cambiados |= set(self.vistos) - set(actuales)
+        self.vistos = actuales
+        return cambiados
+
+    def procesar(self, nombres):
+        """Regenera los reportes de los archivos cuyo contenido cambió; devuelve cuántos fueron."""
+        os.makedirs(self.salida, exist_ok=True)
+        procesados = 0
+        for nombre in sorted(nombres):
+            ruta = os.path.join(self.directorio, nombre)
+            if not os.path.exists(ruta):
+                self.manifiesto.pop(nombre, None)
+                continue
+            try:
+                h = hash_archivo(ruta)
+            except OSError as e:
+                print(f"[PoliFin] No se pudo leer {nombre}: {e}")
+                continue
+            if self.manifiesto.get(nombre) in (h, MANIFIESTO_ERROR + h):
+                continue
+            try:
+                regenerar_reportes(ruta, self.salida)
+            except Exception as e:
+                # se registra el fallo para no reintentar hasta que cambie el contenido
+                print(f"[PoliFin] No se pudo procesar {nombre}: {e!r}")
+                self.manifiesto[nombre] = MANIFIESTO_ERROR + h
+                continue
+            self.manifiesto[nombre] = h
+            procesados += 1
+            print(f"[PoliFin] Reportes regenerados: {nombre}")
+        tmp = self.ruta_manifiesto + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fp:
+            json.dump(self.manifiesto, fp, indent=4, ensure_ascii=False)
+        os.replace(tmp, self.ruta_manifiesto)
+        return procesados
+
+    def _esperar_cambios(self, inotify, timeout):
+        """Bloquea hasta `timeout` segundos; devuelve los nombres que cambiaron."""
+        if inotify is not None:
+            eventos = inotify.read(timeout=int(timeout * 1000))
+            return {ev.name for ev in eventos if ev.name.endswith(".json") and ev.name != MANIFIESTO}
+        time.sleep(timeout)
+        return self.escanear()
+
+    def ejecutar(self):
+        """Procesa lo pendiente al arrancar y luego vigila la carpeta hasta Ctrl+C."""
+        inotify = None
+        if INOTIFY_AVAILABLE:
+            # la vigilancia empieza antes del primer escaneo para no perder lo escrito mientras tanto
+            inotify = INotify()
+            inotify.add_watch(self.directorio, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO
+                              | inotify_flags.MOVED_FROM | inotify_flags.DELETE)
+        print(f"[PoliFin] Vigilando {self.directorio} ({'inotify' if inotify else 'revisión por mtime'})")
+        try:
+            self.procesar(self.escanear())
+            while True:
+                pendientes = self._esperar_cambios(inotify, self.intervalo if inotify is None else 3600)
+                # agrupar la ráfaga: seguir leyendo mientras lleguen cambios
+                while pendientes:
+                    nuevos = self._esperar_cambios(inotify, self.espera)
+                    if not nuevos:
+                        break
+                    pendientes |= nuevos
+                if pendientes:
+                    self.procesar(pendientes)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+# ---------- Servicio HTTP local (asyncio) ----------
+SERVICIO_HOST = "127.0.0.1"
+SERVICIO_PUERTO = 8765
+SERVICIO_LOTE = 256             # solicitudes de cálculo que se juntan en un lote vectorizado
+SERVICIO_ESPERA_LOTE = 0.002    # segundos que se espera para completar un lote
+SERVICIO_BLOQUE_ENVIO = 64 * 1024
+TIPOS_EXPORTACION = {"pdf": "application/pdf",
+                     "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+ESTADOS_HTTP = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                500: "Internal Server Error"}
+
+def exportar_bytes(data, kind, formato):
+    """Genera el PDF o Excel de un reporte en memoria (se ejecuta en el pool de procesos)."""
+    buf = io.BytesIO()
+    (generar_pdf if formato == "pdf" else generar_excel)(data, kind, buf)
+    return buf.getvalue()
+
+def _separar_lote(estado, i):
+    """Extrae el escenario `i` de un ER calculado con arreglos."""
+    return {k: (_separar_lote(v, i) if isinstance(v, dict) else float(np.asarray(v)[i]) if np.ndim(v) else float(v))
+            for k, v in estado.items()}
+
+class ServicioPoliFin:
+    """Servicio HTTP local que expone los cálculos y la exportación de PoliFin.
+
+    POST /estado_resultados   valores de er_values -> ER calculado (se agrupan en lotes)
+    POST /balance             valores de bal_values -> Balance calculado
+    POST /exportar/pdf|xlsx   {"tipo": "estado"|"balance"|"flujo", "datos" | "valores"} -> archivo
+    GET  /metricas            latencias, profundidad de cola y tamaño de los lotes
+    """
+    def __init__(self, host=SERVICIO_HOST, puerto=SERVICIO_PUERTO, procesos=None):
+        self.host = host
+        self.puerto = puerto
+        # "spawn": un worker creado con fork heredaría los sockets abiertos de los clientes
+        self.pool = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context("spawn"))
+        self.cola = None
+        self.latencias = deque(maxlen=10000)
+        self.solicitudes = 0
+        self.lotes = 0
+        self.calculos_en_lote = 0
+        self.exportaciones_pendientes = 0
+
+    async def ejecutar(self):
+        self.cola = asyncio.Queue()
+        lotes = asyncio.create_task(self._procesar_lotes())
+        server = await asyncio.start_server(self._atender, self.host, self.puerto)
+        print(f"[PoliFin] Servicio en http://{self.host}:{self.puerto}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            lotes.cancel()
+            self.pool.shutdown(cancel_futures=True)
+
+    async def _procesar_lotes(self):
+        """Junta solicitudes de ER y las calcula con una sola llamada vectorizada."""
+        loop = asyncio.get_running_loop()
+        while True:
+            lote = [await self.cola.get()]
+            limite = loop.time() + SERVICIO_ESPERA_LOTE
+            while len(lote) < SERVICIO_LOTE:
+                restante = limite - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self.cola.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                claves = set().union(*(vals for vals, _ in lote))
+                arreglos = {k: np.array([to_float(vals.get(k, 0)) for vals, _ in lote]) for k in claves}
+                estado = calcular_estado_resultados(arreglos)
+                resultados = [_separar_lote(estado, i) for i in range(len(lote))]
+            except Exception as e:
+                # un lote defectuoso no debe detener el ciclo: se avisa a sus solicitudes
+                for _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                continue
+            for (_, futuro), r in zip(lote, resultados):
+                if not futuro.done():
+                    futuro.set_result(r)
+            self.lotes += 1
+            self.calculos_en_lote += len(lote)
+
+    def metricas(self):
+        lat = np.array(self.latencias) * 1000
+        pct = np.percentile(lat, [50, 95, 99]).tolist() if len(lat) else [0.0, 0.0, 0.0]
+        return {
+            "solicitudes": self.solicitudes,
+            "latencia_ms": dict(zip(("p50", "p95", "p99"), pct)),
+            "cola_calculo": self.cola.qsize() if self.cola else 0,
+            "exportaciones_pendientes": self.exportaciones_pendientes,
+            "lotes": self.lotes,
+            "tamano_lote_promedio": self.calculos_en_lote / self.lotes if self.lotes else 0.0,
+        }
+
+    async def _atender(self, reader, writer):
+        inicio = time.perf_counter()
+        try:
+            linea = (await reader.readline()).decode("latin-1").split()
+            if len(linea) < 2:
+                return
+            metodo, ruta = linea[0].upper(), linea[1].split("?")[0]
+            largo = 0
+            while True:
+                h = (await reader.readline()).decode("latin-1").strip()
+                if not h:
+                    break
+                nombre, _, valor = h.partition(":")
+                if nombre.strip().lower() == "content-length":
+                    largo = int(valor)
+            cuerpo = await reader.readexactly(largo) if largo else b""
+            await self._enrutar(metodo, ruta, cuerpo, writer)
+        except (ValueError, KeyError) as e:
+            await self._responder(writer, 400, {"error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        except Exception as e:
+            await self._responder(writer, 500, {"error": str(e)})
+        finally:
+            self.solicitudes += 1
+            self.latencias.append(time.perf_counter() - inicio)
+            writer.close()
+
+    async def _enrutar(self, metodo, ruta, cuerpo, writer):
+        if ruta == "/metricas":
+            return await self._responder(writer, 200, self.metricas())
+        if ruta not in ("/estado_resultados", "/balance") and not ruta.startswith("/exportar/"):
+            return await self._responder(writer, 404, {"error": f"Ruta desconocida: {ruta}"})
+        if metodo != "POST":
+            return await self._responder(writer, 405, {"error": "Use POST"})
+        datos = json.loads(cuerpo or b"{}")
+        if not isinstance(datos, dict):
+            return await self._responder(writer, 400, {"error": "El cuerpo debe ser un objeto JSON"})
+        if ruta == "/estado_resultados":
+            futuro = asyncio.get_running_loop().create_future()
+            await self.cola.put((datos, futuro))
+            return await self._responder(writer, 200, await futuro)
+        if ruta == "/balance":
+            return await self._responder(writer, 200, calcular_balance({k: to_float(v) for k, v in datos.items()}))
+        formato = ruta.rsplit("/", 1)[1]
+        if formato not in TIPOS_EXPORTACION:
+            return await self._responder(writer, 404, {"error": f"Formato desconocido: {formato}"})
+        kind = datos.get("tipo", "estado")
+        campo = "datos" if "datos" in datos else "valores"
+        if not isinstance(datos.get(campo, {}), dict):
+            return await self._responder(writer, 400, {"error": f"'{campo}' debe ser un objeto JSON"})
+        if "datos" in datos:
+            data = datos["datos"]
+        elif kind == "estado":
+            data = {"estado_resultados": calcular_estado_resultados({k: to_float(v) for k, v in datos.get("valores", {}).items()})}
+        elif kind == "balance":
+            data = {"balance": calcular_balance({k: to_float(v) for k, v in datos.get("valores", {}).items()})}
+        else:
+            raise ValueError("Para exportar el flujo de efectivo envíe 'datos'")
+        self.exportaciones_pendientes += 1
+        try:
+            contenido = await asyncio.get_running_loop().run_in_executor(self.pool, exportar_bytes, data, kind, formato)
+        finally:
+            self.exportaciones_pendientes -= 1
+        await self._enviar_por_bloques(writer, contenido, TIPOS_EXPORTACION[formato])
+
+    async def _responder(self, writer, estado, cuerpo):
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+        writer.write(f"HTTP/1.1 {estado} {ESTADOS_HTTP[estado]}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                     f"Content-Length: {len(datos)}\r\nConnection: close\r\n\r\n".encode("latin-1") + datos)
+        await writer.drain()
+
+    async def _enviar_por_bloques(self, writer, contenido, tipo):
+        writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: {tipo}\r\nTransfer-Encoding: chunked\r\n"
+                     "Connection: close\r\n\r\n".encode("latin-1"))
+        for i in range(0, len(contenido), SERVICIO_BLOQUE_ENVIO):
+            bloque = contenido[i:i + SERVICIO_BLOQUE_ENVIO]
+            writer.write(f"{len(bloque):X}\r\n".encode("latin-1") + bloque + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+async def _solicitud(host, puerto, metodo, ruta, cuerpo=None):
+    """Cliente HTTP mínimo para la prueba de carga; devuelve (estado, cuerpo)."""
+    reader, writer = await asyncio.open_connection(host, puerto)
+    datos = json.dumps(cuerpo).encode("utf-8") if cuerpo is not None else b""
+    writer.write(f"{metodo} {ruta} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(datos)}\r\nConnection: close\r\n\r\n".encode("latin-1") + datos)
+    await writer.drain()
+    respuesta = await reader.read()
+    writer.close()
+    encabezado, _, resto = respuesta.partition(b"\r\n\r\n")
+    return int(encabezado.split()[1]), resto
+
+async def prueba_carga(host=SERVICIO_HOST, puerto=SERVICIO_PUERTO, n=5000, concurrencia=100):
+    """Envía `n` cálculos de ER con `concurrencia` clientes simultáneos y resume las latencias."""
+    rng = np.random.default_rng()
+    latencias = []
+    errores = 0
+    pendientes = iter(range(n))
+
+    async def cliente():
+        nonlocal errores
+        for _ in pendientes:
+            vals = {"Ventas totales": float(rng.uniform(1e5, 1e6)), "compras": float(rng.uniform(1e4, 5e5)),
+                    "Renta de oficinas": float(rng.uniform(1e3, 5e4))}
+            t = time.perf_counter()
+            try:
+                estado, _ = await _solicitud(host, puerto, "POST", "/estado_resultados", vals)
+                if estado != 200:
+                    errores += 1
+            except OSError:
+                errores += 1
+            latencias.append(time.perf_counter() - t)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente() for _ in range(concurrencia)))
+    total = time.perf_counter() - inicio
+    lat = np.array(latencias) * 1000
+    _, metricas = await _solicitud(host, puerto, "GET", "/metricas")
+    return {
+        "solicitudes": n,
+        "errores": errores,
+        "segundos": total,
+        "solicitudes_por_segundo": n / total if total else 0.0,
+        "latencia_ms": dict(zip(("p50", "p95", "p99"), np.percentile(lat, [50, 95, 99]).tolist())),
+        "servidor": json.loads(metricas),
+    }
+
+# ---------- Multimoneda (tipos de cambio locales) ----------
+MONEDA_BASE = "MXN"
+
+class TiposDeCambio:
+    """Tipos de cambio cargados de CSV locales e indexados por (moneda, tipo) y fecha.
+
+    Cada CSV trae las columnas fecha, moneda, tipo ("cierre" o "promedio") y tasa
+    (pesos por unidad). Para una fecha se usa la última tasa publicada en o antes de ella,
+    buscada con bisección sobre las fechas ordenadas.
+    """
+    def __init__(self):
+        self._series = {}   # (moneda, tipo) -> (fechas datetime64[D] ordenadas, tasas)
+        self._cache = {}    # (moneda, fecha, tipo) -> tasa
+
+    @classmethod
+    def desde_csv(cls, *rutas):
+        tipos = cls()
+        df = pd.concat([pd.read_csv(r, dtype={"moneda": str, "tipo": str}) for r in rutas], ignore_index=True)
+        df["moneda"] = df["moneda"].str.strip().str.upper()
+        df["tipo"] = df["tipo"].str.strip().str.lower()
+        df["fecha"] = pd.to_datetime(df["fecha"]).values.astype("datetime64[D]")
+        for (moneda, tipo), g in df.sort_values("fecha").groupby(["moneda", "tipo"]):
+            tipos._series[(moneda, tipo)] = (g["fecha"].to_numpy("datetime64[D]"), g["tasa"].to_numpy(float))
+        return tipos
+
+    def tasas(self, monedas, fechas, tipo):
+        """Tasas para arreglos de monedas y fechas (vectorizado por moneda)."""
+        monedas = np.asarray(monedas, dtype=object)
+        fechas = np.asarray(fechas, dtype="datetime64[D]")
+        resultado = np.ones(len(monedas))
+        for moneda in set(monedas.tolist()) - {MONEDA_BASE}:
+            if (moneda, tipo) not in self._series:
+                raise KeyError(f"No hay tipo de cambio {tipo} para {moneda}")
+            serie_fechas, serie_tasas = self._series[(moneda, tipo)]
+            sel = monedas == moneda
+            i = np.searchsorted(serie_fechas, fechas[sel], side="right") - 1
+            if (i < 0).any():
+                raise KeyError(f"No hay tipo de cambio {tipo} para {moneda} al {fechas[sel][i < 0][0]}")
+            resultado[sel] = serie_tasas[i]
+        return resultado
+
+    def tasa(self, moneda, fecha, tipo="cierre"):
+        """Tasa de una moneda en una fecha (con caché en memoria)."""
+        clave = (moneda.upper(), str(fecha)[:10], tipo)
+        if clave not in self._cache:
+            self._cache[clave] = float(self.tasas([clave[0]], [clave[1]], tipo)[0])
+        return self._cache[clave]
+
+def _convertir_estados(estados, tasas, extraer, calcular):
+    """Convierte un lote de estados multiplicando cada fila por su tasa y los recalcula juntos."""
+    filas = [extraer(e) for e in estados]
+    catalogo = {}
+    for vals in filas:
+        for k in vals:
+            catalogo.setdefault(k, len(catalogo))
+    m = np.zeros((len(filas), len(catalogo)))
+    for i, vals in enumerate(filas):
+        for k, v in vals.items():
+            m[i, catalogo[k]] = v
+    m *= tasas[:, None]
+    estado = calcular({k: m[:, j] for k, j in catalogo.items()})
+    return [_separar_lote(estado, i) for i in range(len(filas))]
+
+def fecha_de_cierre(datos, fecha=None):
+    """Fecha de cierre de una entidad: su "fecha", el último día de su "periodo" (AAAA-MM) o `fecha`."""
+    if datos.get("fecha"):
+        return datos["fecha"]
+    if datos.get("periodo"):
+        return (periodo_de_datos(datos) + pd.offsets.MonthEnd(0)).strftime("%Y-%m-%d")
+    return fecha
+
+def convertir_entidades(entidades, tipos_cambio, fecha=None):
+    """Convierte a pesos los estados de varias entidades.
+
+    Cada entidad puede indicar "moneda" (por omisión MXN), "fecha" de cierre o "periodo"
+    (se toma su último día; si no hay ninguno se usa `fecha`) y "tasa_historica" para su capital inicial (por omisión la tasa promedio).
+    El Balance se convierte a tipo de cierre y el ER a tipo promedio; la diferencia en el
+    capital se reporta como "Efecto por conversión" en los totales del Balance.
+    """
+    ids = list(entidades)
+    monedas = [str(entidades[i].get("moneda", MONEDA_BASE)).upper() for i in ids]
+    fechas = [fecha_de_cierre(entidades[i], fecha) for i in ids]
+    extranjeras = [n for n, m in enumerate(monedas) if m != MONEDA_BASE]
+    if any(fechas[n] is None for n in extranjeras):
+        raise ValueError("Falta la fecha de cierre para convertir entidades en moneda extranjera")
+    fechas = [f or "1970-01-01" for f in fechas]
+    cierre = tipos_cambio.tasas(monedas, fechas, "cierre")
+    promedio = tipos_cambio.tasas(monedas, fechas, "promedio")
+    historica = np.array([to_float(entidades[i].get("tasa_historica")) or promedio[n] for n, i in enumerate(ids)])
+    historica[[m == MONEDA_BASE for m in monedas]] = 1.0
+
+    resultado = {i: dict(entidades[i], moneda_original=monedas[n], moneda=MONEDA_BASE) for n, i in enumerate(ids)}
+    for clave, tasas, extraer, calcular in (("estado_resultados", promedio, valores_de_estado, calcular_estado_resultados),
+                                            ("balance", cierre, valores_de_balance, calcular_balance)):
+        sel = [n for n, i in enumerate(ids) if clave in entidades[i]]
+        if sel:
+            convertidos = _convertir_estados([entidades[ids[n]][clave] for n in sel], tasas[sel], extraer, calcular)
+            for n, estado in zip(sel, convertidos):
+                resultado[ids[n]][clave] = estado
+    # efecto por conversión: capital a cierre - (capital inicial a histórico + utilidad a promedio)
+    for n, i in enumerate(ids):
+        if "balance" not in entidades[i]:
+            continue
+        capital = entidades[i]["balance"].get("totales", {}).get("Capital Contable", 0)
+        un = entidades[i].get("estado_resultados", {}).get("utilidad_neta", 0)
+        efecto = capital * cierre[n] - ((capital - un) * historica[n] + un * promedio[n])
+        resultado[i]["balance"]["totales"]["Efecto por conversión"] = float(efecto)
+    return resultado
+
 # ---------- App ----------
 class PoliFinApp:
     def __init__(self, root):
@@ -66,6 +1508,9 @@ class PoliFinApp:
         # central data
         self.data = {}
         self.current_report = None
+        self.cash_flow = FlujoEfectivo()
+        self.cash_flow_sources = []
+        self.fixed_assets = None
 
         # state for section navigation
         self.current_frame = None
@@ -171,6 +1616,8 @@ class PoliFinApp:
                   font=SUB_FONT, relief="flat", command=self.start_balance_sections).grid(row=1, column=0, padx=10, pady=8)
 
         tk.Button(frame, text="Cargar archivo (JSON)", bg=CARD, fg=FG, width=24, command=self.load_file, relief="flat").pack(pady=8)
+        tk.Button(frame, text="Consolidar entidades (JSON)", bg=CARD, fg=FG, width=28, command=self.consolidate_files, relief="flat").pack(pady=4)
+        tk.Button(frame, text="Flujo de efectivo (JSON por periodo)", bg=CARD, fg=FG, width=28, command=self.cash_flow_files, relief="flat").pack(pady=4)
         tk.Button(frame, text="Exportar último reporte (PDF/Excel)", bg=CARD, fg=FG, width=28, command=self.export_menu, relief="flat").pack(pady=4)
         tk.Button(frame, text="Guardar datos actuales (JSON)", bg=CARD, fg=FG, width=28, command=self.save_file, relief="flat").pack(pady=4)
 
@@ -179,6 +1626,8 @@ class PoliFinApp:
     # ----------------- ESTADO DE RESULTADOS (secciones) -----------------
     def start_er_sections(self):
         self.er_values = {}
+        if "activos_fijos" in self.data:
+            self.er_values["depreciacion del ejercicio"] = self.data["activos_fijos"]["depreciacion del ejercicio"]
         self.er_sections = [
             self.er_section_ventas,
             self.er_section_compras,
@@ -250,10 +1699,35 @@ class PoliFinApp:
         for k in list(self.current_entries.keys()):
             if k in self.er_values:
                 self.current_entries[k].insert(0, str(self.er_values[k]))
+        inv = tk.Frame(frame, bg=BG); inv.pack(fill="x", pady=(6,0))
+        metodo = ttk.Combobox(inv, values=METODOS_INVENTARIO, state="readonly", width=12)
+        metodo.set("PEPS")
+        metodo.pack(side="left")
+        tk.Button(inv, text="Calcular inventarios desde movimientos (CSV)", bg=CARD, fg=FG,
+                  command=lambda: self.er_inventory_from_movements(metodo.get()), relief="flat").pack(side="left", padx=6)
         nav = tk.Frame(frame, bg=BG); nav.pack(fill="x", pady=12)
         tk.Button(nav, text="← Anterior", bg=CARD, fg=FG, command=self.er_prev, relief="flat").pack(side="left")
         tk.Button(nav, text="Siguiente →", bg=GUINDA, fg="white", command=self.er_next, relief="flat").pack(side="right")
 
+    def er_inventory_from_movements(self, metodo):
+        f = filedialog.askopenfilename(filetypes=[("CSV files","*.csv"),("All files","*.*")])
+        if not f:
+            return
+        try:
+            r = costear_inventario(leer_movimientos(f), metodo)
+        except (ValueError, KeyError) as e:
+            messagebox.showerror("Error", f"No se pudo costear el inventario:\n{e}")
+            return
+        campos = ["inventario inicial", "inventario final"]
+        # las compras del periodo salen de las mismas entradas; sólo se llenan si no se capturaron
+        if not to_float(self.current_entries["compras"].get()):
+            campos.append("compras")
+        for k in campos:
+            self.current_entries[k].delete(0, "end")
+            self.current_entries[k].insert(0, f"{r[k]:.2f}")
+        messagebox.showinfo("Inventarios", f"Método: {metodo}\nSKUs: {r['skus']:,}\n"
+                                           f"Costo de lo vendido: {money(r['costo de lo vendido'])}")
+
     def er_section_gastos_venta(self):
         self.header_bar("ESTADO DE RESULTADOS — Gastos de Venta")
         frame = tk.Frame(self.root, bg=BG, padx=20, pady=12); frame.pack(fill="both", expand=True)
@@ -281,6 +1755,7 @@ class PoliFinApp:
         self.current_entries["sueldos del personal de oficinas"] = self.add_field(frame, "Sueldos del personal de oficinas")
         self.current_entries["papeleria y utiles"] = self.add_field(frame, "Papelería y útiles")
         self.current_entries["consumo de luz de oficinas"] = self.add_field(frame, "Consumo de luz de oficinas")
+        self.current_entries["depreciacion del ejercicio"] = self.add_field(frame, "Depreciación del ejercicio")
         for k in list(self.current_entries.keys()):
             if k in self.er_values:
                 self.current_entries[k].insert(0, str(self.er_values[k]))
@@ -334,102 +1809,67 @@ class PoliFinApp:
         for k in list(self.current_entries.keys()):
             if k in self.er_values:
                 self.current_entries[k].insert(0, str(self.er_values[k]))
+        tk.Button(frame, text="Calcular PTU desde plantilla (CSV)", bg=CARD, fg=FG,
+                  command=self.er_ptu_from_roster, relief="flat").pack(anchor="w", pady=(6,0))
+        tk.Button(frame, text="Calcular ISR con tabla del ejercicio", bg=CARD, fg=FG,
+                  command=self.er_isr_from_table, relief="flat").pack(anchor="w", pady=(6,0))
 
         nav = tk.Frame(frame, bg=BG); nav.pack(fill="x", pady=12)
         tk.Button(nav, text="← Anterior", bg=CARD, fg=FG, command=self.er_prev, relief="flat").pack(side="left")
         tk.Button(nav, text="Calcular →", bg=GUINDA, fg="white", command=self.er_next, relief="flat").pack(side="right")
 
+    def er_ptu_from_roster(self):
+        f = filedialog.askopenfilename(filetypes=[("CSV files","*.csv"),("All files","*.*")])
+        if not f:
+            return
+        self.er_save_current_entries()
+        utilidad = calcular_estado_resultados(self.er_values)["utilidad_antes_isr_ptu"]
+        try:
+            ids, dias, salarios, promedios = leer_plantilla(f)
+        except (ValueError, KeyError) as e:
+            messagebox.showerror("Error", f"No se pudo leer la plantilla:\n{e}")
+            return
+        r = calcular_ptu(utilidad, dias, salarios, promedios)
+        clave = "Participacion de los trabajadores en las utilidades"
+        self.er_values[clave] = r["total"]
+        self.current_entries[clave].delete(0, "end")
+        self.current_entries[clave].insert(0, f"{r['total']:.2f}")
+        self.data["ptu"] = {"base": r["base"], "total": r["total"], "no_repartido": r["no_repartido"], "trabajadores": len(ids)}
+        messagebox.showinfo("PTU", f"Trabajadores: {len(ids):,}\nPTU a repartir: {money(r['base'])}\n"
+                                   f"PTU repartida: {money(r['total'])}\nNo repartida por topes: {money(r['no_repartido'])}")
+        detalle = filedialog.asksaveasfilename(title="Guardar reparto por trabajador (opcional)",
+                                               defaultextension=".csv", filetypes=[("CSV files","*.csv")])
+        if detalle:
+            pd.DataFrame({"empleado": ids, "ptu": r["montos"]}).to_csv(detalle, index=False)
+
+    def er_isr_from_table(self):
+        anio = simpledialog.askinteger("ISR", "Ejercicio fiscal:", initialvalue=datetime.now().year, parent=self.root)
+        if not anio:
+            return
+        self.er_save_current_entries()
+        estado = calcular_estado_resultados(self.er_values)
+        try:
+            isr = float(aplicar_isr([estado], anio)[0])
+        except FileNotFoundError as e:
+            if not messagebox.askyesno("ISR", f"{e}\n\n¿Usar la tasa fija de personas morales "
+                                              f"({ISR_TASA_PERSONAS_MORALES:.0%})?"):
+                return
+            isr = float(aplicar_isr([estado], anio, tasa_fija=ISR_TASA_PERSONAS_MORALES)[0])
+        except (ValueError, KeyError) as e:
+            messagebox.showerror("Error", f"No se pudo leer la tabla de ISR {anio}:\n{e}")
+            return
+        clave = "Impuesto  sobre la renta ISR"
+        self.er_values[clave] = isr
+        self.current_entries[clave].delete(0, "end")
+        self.current_entries[clave].insert(0, f"{isr:.2f}")
+
     def er_er_calc_and_finish(self):
         # Save last screen inputs
         self.er_save_current_entries()
         vals = self.er_values
 
-        # --- Cálculos ---
-        ventas_tot = vals.get("Ventas totales", 0)
-        devV = vals.get("devoluciones sobre ventas", 0)
-        descV = vals.get("descuentos sobre ventas", 0)
-        ventas_net = ventas_tot - devV - descV
-
-        inv_ini = vals.get("inventario inicial", 0)
-        compras = vals.get("compras", 0)
-        gastos_compra = vals.get("gastos de compra", 0)
-        compras_totales = compras + gastos_compra
-        devC = vals.get("devoluciones sobre compras", 0)
-        descC = vals.get("descuentos sobre compras", 0)
-        compras_netas = compras_totales - devC - descC
-        suma_merc = inv_ini + compras_netas
-        inv_fin = vals.get("inventario final", 0)
-        costo_vendido = suma_merc - inv_fin
-
-        utilidad_bruta = ventas_net - costo_vendido
-
-        gastos_venta_total = vals.get("Renta de almacen", 0) + vals.get("Propaganda y publicidad", 0) + vals.get("Sueldos de agentes y dependeientes", 0) + vals.get("comisiones de agentes y dependientes", 0) + vals.get("consumo de luz del almacen", 0)
-        gastos_admin_total = vals.get("Renta de oficinas", 0) + vals.get("sueldos del personal de oficinas", 0) + vals.get("papeleria y utiles", 0) + vals.get("consumo de luz de oficinas", 0)
-        gastos_operacion_total = gastos_venta_total + gastos_admin_total
-
-        productos_financieros = vals.get("Intereses cobrados", 0) + vals.get("ganancia en cambios", 0)
-        gastos_financieros = vals.get("intereses pagados", 0) + vals.get("perdida en cambios", 0)
-
-        utilidad_operacion = utilidad_bruta - gastos_operacion_total + productos_financieros - gastos_financieros
-
-        otros_gastos = vals.get("Perdida en venta de mobiliario", 0) + vals.get("perdida en venta de acciones", 0)
-        otros_productos = vals.get("Comisiones cobradas", 0) + vals.get("dividendos cobrados", 0)
-        perdida_entre_otros = vals.get("perdida entre otros gastos y productos", 0)
-
-        utilidad_antes_isr_ptu = utilidad_operacion - otros_gastos + otros_productos - perdida_entre_otros
-
-        isr = vals.get("Impuesto  sobre la renta ISR", 0)
-        ptu = vals.get("Participacion de los trabajadores en las utilidades", 0)
-        utilidad_neta = utilidad_antes_isr_ptu - isr - ptu
-
-        # store
-        self.data["estado_resultados"] = {
-            "Ventas totales": ventas_tot,
-            "devoluciones sobre ventas": devV,
-            "descuentos sobre ventas": descV,
-            "ventas netas": ventas_net,
-            "inventario inicial": inv_ini,
-            "compras": compras,
-            "gastos de compra": gastos_compra,
-            "compras totales": compras_totales,
-            "devoluciones sobre compras": devC,
-            "descuentos sobre compras": descC,
-            "compras netas": compras_netas,
-            "suma o total de mercancías": suma_merc,
-            "inventario final": inv_fin,
-            "costo de lo vendido": costo_vendido,
-            "utilidad bruta": utilidad_bruta,
-            "gastos de operación": gastos_operacion_total,
-            "gastos de venta detalle": {
-                "Renta de almacen": vals.get("Renta de almacen", 0),
-                "Propaganda y publicidad": vals.get("Propaganda y publicidad", 0),
-                "Sueldos de agentes y dependeientes": vals.get("Sueldos de agentes y dependeientes", 0),
-                "comisiones de agentes y dependientes": vals.get("comisiones de agentes y dependientes", 0),
-                "consumo de luz del almacen": vals.get("consumo de luz del almacen", 0)
-            },
-            "gastos de administracion detalle": {
-                "Renta de oficinas": vals.get("Renta de oficinas", 0),
-                "sueldos del personal de oficinas": vals.get("sueldos del personal de oficinas", 0),
-                "papeleria y utiles": vals.get("papeleria y utiles", 0),
-                "consumo de luz de oficinas": vals.get("consumo de luz de oficinas", 0)
-            },
-            "productos_financieros": productos_financieros,
-            "gastos_financieros": gastos_financieros,
-            "utilidad_operacion": utilidad_operacion,
-            "otros_gastos_detalle": {
-                "Perdida en venta de mobiliario": vals.get("Perdida en venta de mobiliario", 0),
-                "perdida en venta de acciones": vals.get("perdida en venta de acciones", 0)
-            },
-            "otros_productos_detalle": {
-                "Comisiones cobradas": vals.get("Comisiones cobradas", 0),
-                "dividendos cobrados": vals.get("dividendos cobrados", 0)
-            },
-            "perdida_entre_otros": perdida_entre_otros,
-            "utilidad_antes_isr_ptu": utilidad_antes_isr_ptu,
-            "ISR": isr,
-            "PTU": ptu,
-            "utilidad_neta": utilidad_neta
-        }
+        self.data["estado_resultados"] = calcular_estado_resultados(vals)
+        utilidad_neta = self.data["estado_resultados"]["utilidad_neta"]
 
         self.current_report = ("estado", "reporte")
         messagebox.showinfo("Resultado", f"Estado calculado. Utilidad neta: {money(utilidad_neta)}")
@@ -465,9 +1905,29 @@ class PoliFinApp:
         btns = tk.Frame(self.root, bg=BG); btns.pack(pady=8)
         tk.Button(btns, text="Ver Reporte", bg=GUINDA, fg="white", command=lambda: self.view_er_report("reporte"), relief="flat").pack(side="left", padx=6)
         tk.Button(btns, text="Ver Cuenta", bg=CARD, fg=FG, command=lambda: self.view_er_report("cuenta"), relief="flat").pack(side="left", padx=6)
+        tk.Button(btns, text="Simular escenarios", bg=CARD, fg=FG, command=self.simulate_er, relief="flat").pack(side="left", padx=6)
         tk.Button(btns, text="Exportar PDF/Excel", bg=CARD, fg=FG, command=self.export_menu, relief="flat").pack(side="left", padx=6)
         tk.Button(btns, text="Volver al menú", bg=CARD, fg=FG, command=self.build_main_menu, relief="flat").pack(side="left", padx=6)
 
+    def simulate_er(self):
+        """Simula la utilidad neta variando ventas, costos y gastos de operación (normal, ± % capturado)."""
+        pct = simpledialog.askfloat("Simular escenarios", "Desviación estándar (% del valor capturado):",
+                                    initialvalue=10.0, minvalue=0.0, parent=self.root)
+        if pct is None:
+            return
+        n = simpledialog.askinteger("Simular escenarios", "Número de escenarios:",
+                                    initialvalue=1_000_000, minvalue=1, parent=self.root)
+        if not n:
+            return
+        base = valores_de_estado(self.data.get("estado_resultados", {}))
+        cuentas = ["Ventas totales", "compras", "gastos de compra"] + ER_GASTOS_OPERACION
+        dist = {k: ("normal", base[k], abs(base[k]) * pct / 100) for k in cuentas if base.get(k)}
+        r = simular_escenarios(base, dist, n)
+        s = "\n".join(f"{k}: {money(v)}" for k,v in r["percentiles"].items())
+        messagebox.showinfo("Simulación", f"Escenarios: {r['escenarios']:,}\n"
+                                          f"Utilidad neta media: {money(r['media'])}\n{s}\n"
+                                          f"Probabilidad de pérdida: {r['probabilidad_perdida']:.2%}")
+
     def view_er_report(self, mode="reporte"):
         vals = self.data.get("estado_resultados", {})
         self.current_report = ("estado", mode)
@@ -549,7 +2009,7 @@ class PoliFinApp:
         self.current_entries["Clientes"] = self.add_field(frame, "Clientes")
         self.current_entries["Documentos por cobrar"] = self.add_field(frame, "Documentos por cobrar")
         self.current_entries["Deudores diversos"] = self.add_field(frame, "Deudores diversos")
-        self.current_entries["Inventarios (circulante)"] = self.add_field(frame, "Anticipo a proveedores")
+        self.current_entries["Anticipo a proveedores"] = self.add_field(frame, "Anticipo a proveedores")
         for k in list(self.current_entries.keys()):
             if k in self.bal_values:
                 self.current_entries[k].insert(0, str(self.bal_values[k]))
@@ -571,10 +2031,40 @@ class PoliFinApp:
         for k in list(self.current_entries.keys()):
             if k in self.bal_values:
                 self.current_entries[k].insert(0, str(self.bal_values[k]))
+        tk.Button(frame, text="Cargar registro de activos fijos (CSV)", bg=CARD, fg=FG,
+                  command=self.b_fixed_assets_from_register, relief="flat").pack(anchor="w", pady=(6,0))
         nav = tk.Frame(frame, bg=BG); nav.pack(fill="x", pady=12)
         tk.Button(nav, text="← Anterior", bg=CARD, fg=FG, command=self.b_prev, relief="flat").pack(side="left")
         tk.Button(nav, text="Siguiente →", bg=GUINDA, fg="white", command=self.b_next, relief="flat").pack(side="right")
 
+    def b_fixed_assets_from_register(self):
+        f = filedialog.askopenfilename(filetypes=[("CSV files","*.csv"),("All files","*.*")])
+        if not f:
+            return
+        cierre = simpledialog.askstring("Activo fijo", "Fecha de cierre (AAAA-MM):",
+                                        initialvalue=datetime.now().strftime("%Y-%m"), parent=self.root)
+        if not cierre:
+            return
+        try:
+            fechas = pd.read_csv(f, usecols=["fecha_adquisicion"])["fecha_adquisicion"]
+            inicio = min(mes_de_fecha(x) for x in fechas)
+            fin = mes_de_fecha(cierre)
+            registro = RegistroActivos(inicio, max(fin - inicio + 1, 1))
+            registro.cargar_csv(f)
+            r = registro.resumen(cierre)
+        except (ValueError, KeyError) as e:
+            messagebox.showerror("Error", f"No se pudo procesar el registro de activos:\n{e}")
+            return
+        self.fixed_assets = registro
+        self.data["activos_fijos"] = r
+        for k,v in r["valor neto"].items():
+            self.bal_values[k] = v
+            self.current_entries[k].delete(0, "end")
+            self.current_entries[k].insert(0, f"{v:.2f}")
+        messagebox.showinfo("Activo fijo", f"Activos: {r['activos']:,}\n"
+                                           f"Depreciación del ejercicio: {money(r['depreciacion del ejercicio'])}\n"
+                                           "Se usará en los gastos de administración del Estado de Resultados.")
+
     def b_section_activo_dif(self):
         self.header_bar("BALANCE GENERAL — Activo Diferido o Cargas Diferidas")
         frame = tk.Frame(self.root, bg=BG, padx=20, pady=12); frame.pack(fill="both", expand=True)
@@ -646,30 +2136,7 @@ class PoliFinApp:
 
     def b_balance_finalize(self):
         self.b_save_current_entries()
-        bal = self.bal_values
-        activo_cir = sum([bal.get(k,0) for k in ["Caja","Bancos","Inversiones Temporales", "Mercancías", "Inventario o Almacén", "Clientes", "Documentos por Cobrar", "Deudores Diversos", "Anticipo a Proveedores"]])
-        activo_no_cir = sum([bal.get(k,0) for k in ["Terrenos","Edificios","Mobiliario y equipo","Equipo de computo", "Equipo de Entrega o Reparto", "Dépositos en Garantía", "Inversiones Permanentes"]]) 
-        activo_dif = sum([bal.get(k,0) for k in ["Gastos de Inversión y Desarrollo", "Gastos en Etapas Prosperativas, de Organización y Administración","Gastos de Mercadotecnia","Gastos de Instalación","Papelería y Útiles","Propaganda y Publicidad","Primas de Seguros","Rentas Pagadas por Anticipado","Intereses Pagados por Anticipado"]]) 
-        total_activos = activo_cir + activo_no_cir + activo_dif
-
-        pasivo_corto = sum([bal.get(k,0) for k in ["Proveedores","Acreedores diversos","Documentos por pagar","Anticipo de Clientes","Gastos Pendientes de Pago, por Pagar o Acumulados","Impuestos Pendientes de Pago, por Pagar o Acumulados"]])
-        pasivo_largo = sum([bal.get(k,0) for k in ["Hipotecas por pagar o Acreedores Hipotecarios","Documentos por Pagar a Largo Plazo","Cuentas por Pagar a Largo Plazo"]])
-        pasivo_dif = sum([bal.get(k,0) for k in ["Proveedores","Rentas Cobradas por Anticipado","Intereses Cobrados por Anticipado"]])
-        total_pasivos = pasivo_corto + pasivo_largo + pasivo_dif
-
-        self.data["balance"] = {
-            "Activo Circulante detalle": {k: bal.get(k,0) for k in ["Caja","Bancos","Inversiones Temporales", "Mercancías", "Inventario o Almacén", "Clientes", "Documentos por Cobrar", "Deudores Diversos", "Anticipo a Proveedores"]},
-            "Activo No Circulante detalle": {k: bal.get(k,0) for k in ["Terrenos","Edificios","Mobiliario y equipo","Equipo de computo", "Equipo de Entrega o Reparto", "Dépositos en Garantía", "Inversiones Permanentes"]},
-            "Activo Diferido detalle": {k: bal.get(k,0) for k in ["Gastos de Inversión y Desarrollo", "Gastos en Etapas Prosperativas, de Organización y Administración","Gastos de Mercadotecnia","Gastos de Instalación","Papelería y Útiles","Propaganda y Publicidad","Primas de Seguros","Rentas Pagadas por Anticipado","Intereses Pagados por Anticipado"]},
-            "Pasivo Corto detalle": {k: bal.get(k,0) for k in ["Proveedores","Acreedores diversos","Documentos por pagar","Anticipo de Clientes","Gastos Pendientes de Pago, por Pagar o Acumulados","Impuestos Pendientes de Pago, por Pagar o Acumulados"]},
-            "Pasivo Largo detalle": {k: bal.get(k,0) for k in ["Hipotecas por pagar o Acreedores Hipotecarios","Documentos por Pagar a Largo Plazo","Cuentas por Pagar a Largo Plazo"]},
-            "Pasivo Diferido detalle": {k: bal.get(k,0) for k in["Proveedores","Rentas Cobradas por Anticipado","Intereses Cobrados por Anticipado"]},
-            "totales": {
-                "Total Activos": total_activos,
-                "Total Pasivos": total_pasivos,
-                "Capital Contable": total_activos - total_pasivos 
-            }
-        }
+        self.data["balance"] = calcular_balance(self.bal_values)
 
         self.clear()
         self.header_bar("BALANCE GENERAL — Generado")
@@ -709,11 +2176,70 @@ class PoliFinApp:
         t.insert("1.0", s)
         tk.Button(self.root, text="Volver", bg=CARD, fg=FG, command=self.build_main_menu, relief="flat").pack(pady=8)
 
+    # ----------------- FLUJO DE EFECTIVO -----------------
+    def cash_flow_files(self):
+        archivos = filedialog.askopenfilenames(title="Balances por periodo", filetypes=[("JSON files","*.json")])
+        if len(archivos) < 2:
+            if archivos:
+                messagebox.showerror("Error", "Se necesitan al menos dos balances consecutivos.")
+            return
+        # los periodos se ordenan por el campo "periodo"/"fecha" de cada archivo, no por su nombre
+        fuentes = []
+        cargados = {}
+        try:
+            for f in archivos:
+                with open(f, "r", encoding="utf-8") as fp:
+                    datos = json.load(fp)
+                if "balance" not in datos:
+                    raise ValueError(f"El archivo no contiene balance:\n{f}")
+                fuentes.append((periodo_de_datos(datos, f), f, os.path.getmtime(f)))
+                cargados[f] = datos
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", str(e))
+            return
+        fuentes.sort()
+        for (p1, f1, _), (p2, f2, _) in zip(fuentes, fuentes[1:]):
+            if p1 == p2:
+                messagebox.showerror("Error", f"Periodo repetido ({p1:%Y-%m-%d}):\n{f1}\n{f2}")
+                return
+        # reutilizar los periodos ya calculados mientras los archivos no hayan cambiado
+        comunes = 0
+        while (comunes < min(len(fuentes), len(self.cash_flow_sources))
+               and fuentes[comunes] == self.cash_flow_sources[comunes]):
+            comunes += 1
+        self.cash_flow.truncar(comunes)
+        for periodo, f, mtime in fuentes[comunes:]:
+            er = cargados[f].get("estado_resultados", {})
+            self.cash_flow.agregar(periodo, cargados[f]["balance"], er.get("utilidad_neta", 0),
+                                   depreciacion_de_estado(er))
+        self.cash_flow_sources = fuentes
+        self.data["flujo_efectivo"] = self.cash_flow.flujos[-1]
+        self.view_cash_flow()
+
+    def view_cash_flow(self):
+        flujo = self.data.get("flujo_efectivo", {})
+        self.current_report = ("flujo", "reporte")
+        self.clear()
+        self.header_bar("ESTADO DE FLUJO DE EFECTIVO")
+        t = tk.Text(self.root, width=100, height=30, font=("Consolas",11))
+        t.pack(padx=10, pady=8)
+        s = "ESTADO DE FLUJO DE EFECTIVO — MÉTODO INDIRECTO\n\n"
+        for k,v in flujo.items():
+            s += f"  {k}: {v:,.2f}\n"
+        t.insert("1.0", s)
+        btns = tk.Frame(self.root, bg=BG); btns.pack(pady=8)
+        tk.Button(btns, text="Exportar PDF/Excel", bg=CARD, fg=FG, command=self.export_menu, relief="flat").pack(side="left", padx=6)
+        tk.Button(btns, text="Volver al menú", bg=CARD, fg=FG, command=self.build_main_menu, relief="flat").pack(side="left", padx=6)
+
     # ----------------- Guardar / Cargar (JSON) -----------------
     def save_file(self):
         f = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON files","*.json")])
         if not f:
             return
+        periodo = simpledialog.askstring("Guardar", "Periodo de los datos (AAAA-MM, opcional):",
+                                         initialvalue=self.data.get("periodo", ""), parent=self.root)
+        if periodo:
+            self.data["periodo"] = periodo.strip()
         with open(f, "w", encoding="utf-8") as fp:
             json.dump(self.data, fp, indent=4, ensure_ascii=False)
         messagebox.showinfo("Guardado", f"Datos guardados en:\n{f}")
@@ -725,6 +2251,9 @@ class PoliFinApp:
         with open(f, "r", encoding="utf-8") as fp:
             self.data = json.load(fp)
         messagebox.showinfo("Cargado", f"Datos cargados desde:\n{f}")
+        self.show_loaded_data()
+
+    def show_loaded_data(self):
         # show logical view
         if "estado_resultados" in self.data:
             self.current_report = ("estado", "reporte")
@@ -732,9 +2261,52 @@ class PoliFinApp:
         elif "balance" in self.data:
             self.current_report = ("balance", "reporte")
             self.view_balance("reporte")
+        elif "flujo_efectivo" in self.data:
+            self.view_cash_flow()
         else:
             self.build_main_menu()
 
+    def consolidate_files(self):
+        archivos = filedialog.askopenfilenames(title="Estados de las entidades", filetypes=[("JSON files","*.json")])
+        if not archivos:
+            return
+        tabla = None
+        if messagebox.askyesno("Consolidar", "¿Cargar tabla de participaciones y eliminaciones (JSON)?"):
+            f = filedialog.askopenfilename(filetypes=[("JSON files","*.json")])
+            if f:
+                with open(f, "r", encoding="utf-8") as fp:
+                    tabla = json.load(fp)
+        entidades = {}
+        for f in archivos:
+            with open(f, "r", encoding="utf-8") as fp:
+                entidades[os.path.splitext(os.path.basename(f))[0]] = json.load(fp)
+        tipos_cambio = None
+        fecha = None
+        extranjeras = [d for d in entidades.values() if str(d.get("moneda", MONEDA_BASE)).upper() != MONEDA_BASE]
+        if extranjeras:
+            rutas = filedialog.askopenfilenames(title="Tipos de cambio (CSV)", filetypes=[("CSV files","*.csv")])
+            if not rutas:
+                return
+            try:
+                tipos_cambio = TiposDeCambio.desde_csv(*rutas)
+            except (ValueError, KeyError) as e:
+                messagebox.showerror("Error", f"No se pudieron leer los tipos de cambio:\n{e}")
+                return
+            if any(not d.get("fecha") and not d.get("periodo") for d in extranjeras):
+                # sin fecha de cierre no se sabe qué tipos de cambio corresponden al periodo
+                fecha = simpledialog.askstring("Consolidar", "Fecha de cierre de las entidades sin 'fecha' ni 'periodo' (AAAA-MM-DD):",
+                                               parent=self.root)
+                if not fecha:
+                    return
+        try:
+            self.data = consolidar(entidades, tabla, tipos_cambio=tipos_cambio, fecha=fecha)
+        except (ValueError, KeyError) as e:
+            messagebox.showerror("Error", f"No se pudo consolidar:\n{e}")
+            return
+        messagebox.showinfo("Consolidado", f"Entidades consolidadas: {self.data['entidades_consolidadas']}\n"
+                                           f"Eliminaciones aplicadas: {self.data['eliminaciones_aplicadas']}")
+        self.show_loaded_data()
+
     # ----------------- Export -----------------
     def export_menu(self):
         if not self.current_report:
@@ -751,81 +2323,7 @@ class PoliFinApp:
         f = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF files","*.pdf")])
         if not f:
             return
-        doc = SimpleDocTemplate(f, pagesize=letter)
-        styles = getSampleStyleSheet()
-        story = []
-
-        # Logos on PDF header (if files exist)
-        if os.path.exists(LOGO_IPN_PATH):
-            try:
-                rl = RLImage(LOGO_IPN_PATH, width=3*cm, height=4*cm)
-                rl.hAlign = "LEFT"
-                story.append(rl)
-            except:
-                pass
-        if os.path.exists(LOGO_UPIIZ_PATH):
-            try:
-                rl2 = RLImage(LOGO_UPIIZ_PATH, width=2.5*cm, height=2.5*cm)
-                rl2.hAlign = "RIGHT"
-                story.append(rl2)
-            except:
-                pass
-
-        story.append(Spacer(1, 8))
-        story.append(Paragraph("PoliFin — Reporte Financiero", styles["Title"]))
-        story.append(Spacer(1, 12))
-
-        if kind == "estado":
-            vals = self.data.get("estado_resultados", {})
-            rows = [["Cuenta", "Monto"]]
-            order = ["Ventas totales","devoluciones sobre ventas","descuentos sobre ventas","ventas netas",
-                     "inventario inicial","compras","gastos de compra","compras totales","devoluciones sobre compras","descuentos sobre compras",
-                     "compras netas","suma o total de mercancías","inventario final","costo de lo vendido","utilidad bruta"]
-            for k in order:
-                rows.append([k, f"{vals.get(k,0):,.2f}"])
-            rows.append(["Gastos de operación", ""])
-            for k,v in vals.get("gastos de venta detalle",{}).items():
-                rows.append([f"  {k}", f"{v:,.2f}"])
-            for k,v in vals.get("gastos de administracion detalle",{}).items():
-                rows.append([f"  {k}", f"{v:,.2f}"])
-            rows.append(["Productos financieros", f"{vals.get('productos_financieros',0):,.2f}"])
-            rows.append(["Gastos financieros", f"{vals.get('gastos_financieros',0):,.2f}"])
-            rows.append(["Utilidad de operación", f"{vals.get('utilidad_operacion',0):,.2f}"])
-            rows.append(["Utilidad antes de ISR y PTU", f"{vals.get('utilidad_antes_isr_ptu',0):,.2f}"])
-            rows.append(["ISR", f"{vals.get('ISR',0):,.2f}"])
-            rows.append(["PTU", f"{vals.get('PTU',0):,.2f}"])
-            rows.append(["UTILIDAD NETA DEL EJERCICIO", f"{vals.get('utilidad_neta',0):,.2f}"])
-            t = Table(rows, colWidths=[360, 140])
-            t.setStyle(TableStyle([
-                ("GRID",(0,0),(-1,-1),0.3,colors.grey),
-                ("BACKGROUND",(0,0),(-1,0),colors.HexColor(GUINDA)),
-                ("TEXTCOLOR",(0,0),(-1,0),colors.white),
-                ("ALIGN",(1,1),(-1,-1),"RIGHT")
-            ]))
-            story.append(t)
-        else:
-            bal = self.data.get("balance", {})
-            rows = [["Cuenta", "Monto"]]
-            rows.append(["ACTIVOS", ""])
-            for k,v in bal.get("Activo Circulante detalle",{}).items():
-                rows.append([f"  {k}", f"{v:,.2f}"])
-            for k,v in bal.get("Activo No Circulante detalle",{}).items():
-                rows.append([f"  {k}", f"{v:,.2f}"])
-            for k,v in bal.get("Activo Diferido detalle",{}).items():
-                rows.append([f"  {k}", f"{v:,.2f}"])
-            rows.append(["TOTALES", ""])
-            for k,v in bal.get("totales",{}).items():
-                rows.append([k, f"{v:,.2f}"])
-            t = Table(rows, colWidths=[360,140])
-            t.setStyle(TableStyle([
-                ("GRID",(0,0),(-1,-1),0.3,colors.grey),
-                ("BACKGROUND",(0,0),(-1,0),colors.HexColor(GUINDA)),
-                ("TEXTCOLOR",(0,0),(-1,0),colors.white),
-                ("ALIGN",(1,1),(-1,-1),"RIGHT")
-            ]))
-            story.append(t)
-
-        doc.build(story)
+        generar_pdf(self.data, kind, f)
         messagebox.showinfo("PDF generado", f"Se creó el PDF:\n{f}")
 
     def export_excel(self):
@@ -834,49 +2332,37 @@ class PoliFinApp:
         if not f:
             return
 
-        if kind == "estado":
-            vals = self.data.get("estado_resultados", {})
-            rows = []
-            order = ["Ventas totales","devoluciones sobre ventas","descuentos sobre ventas","ventas netas",
-                     "inventario inicial","compras","gastos de compra","compras totales","devoluciones sobre compras","descuentos sobre compras",
-                     "compras netas","suma o total de mercancías","inventario final","costo de lo vendido","utilidad bruta"]
-            for k in order:
-                rows.append({"Cuenta":k, "Monto": vals.get(k,0)})
-            rows.append({"Cuenta":"Gastos de operación", "Monto": ""})
-            for k,v in vals.get("gastos de venta detalle",{}).items():
-                rows.append({"Cuenta":"   "+k, "Monto": v})
-            for k,v in vals.get("gastos de administracion detalle",{}).items():
-                rows.append({"Cuenta":"   "+k, "Monto": v})
-            rows.append({"Cuenta":"Productos financieros", "Monto": vals.get("productos_financieros",0)})
-            rows.append({"Cuenta":"Gastos financieros", "Monto": vals.get("gastos_financieros",0)})
-            rows.append({"Cuenta":"Utilidad de operación", "Monto": vals.get("utilidad_operacion",0)})
-            rows.append({"Cuenta":"Utilidad antes de ISR y PTU", "Monto": vals.get("utilidad_antes_isr_ptu",0)})
-            rows.append({"Cuenta":"ISR", "Monto": vals.get("ISR",0)})
-            rows.append({"Cuenta":"PTU", "Monto": vals.get("PTU",0)})
-            rows.append({"Cuenta":"UTILIDAD NETA DEL EJERCICIO", "Monto": vals.get("utilidad_neta",0)})
-            df = pd.DataFrame(rows)
-            df.to_excel(f, index=False, sheet_name="EstadoResultados")
-        elif kind == "balance":
-            bal = self.data.get("balance", {})
-            rows = []
-            rows.append({"Cuenta":"ACTIVOS", "Monto": ""})
-            for k,v in bal.get("Activo Circulante detalle",{}).items():
-                rows.append({"Cuenta":"  "+k, "Monto": v})
-            for k,v in bal.get("Activo No Circulante detalle",{}).items():
-                rows.append({"Cuenta":"  "+k, "Monto": v})
-            rows.append({"Cuenta":"TOTALES", "Monto": ""})
-            for k,v in bal.get("totales",{}).items():
-                rows.append({"Cuenta": k, "Monto": v})
-            df = pd.DataFrame(rows)
-            df.to_excel(f, index=False, sheet_name="BalanceGeneral")
-        else:
+        if kind not in ("estado", "balance", "flujo"):
             messagebox.showerror("Error", "No hay reporte seleccionado para exportar.")
             return
+        generar_excel(self.data, kind, f)
 
         messagebox.showinfo("Excel generado", f"Se creó el archivo Excel:\n{f}")
 
 # ---------- run ----------
 def main():
+    parser = argparse.ArgumentParser(description="PoliFin — Generador Financiero")
+    parser.add_argument("--vigilar", metavar="CARPETA", help="vigila una carpeta de JSON y regenera sus reportes")
+    parser.add_argument("--salida", metavar="CARPETA", help="carpeta de los reportes generados (por omisión CARPETA/reportes)")
+    parser.add_argument("--servir", action="store_true", help="inicia el servicio HTTP local")
+    parser.add_argument("--prueba-carga", type=int, metavar="N", help="envía N solicitudes al servicio HTTP local")
+    parser.add_argument("--concurrencia", type=int, default=100, help="clientes simultáneos de la prueba de carga")
+    parser.add_argument("--puerto", type=int, default=SERVICIO_PUERTO, help="puerto del servicio HTTP local")
+    args = parser.parse_args()
+    if args.vigilar:
+        VigilanteCarpeta(args.vigilar, args.salida).ejecutar()
+        return
+    if args.servir:
+        try:
+            asyncio.run(ServicioPoliFin(puerto=args.puerto).ejecutar())
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.prueba_carga:
+        r = asyncio.run(prueba_carga(puerto=args.puerto, n=args.prueba_carga, concurrencia=args.concurrencia))
+        print(json.dumps(r, indent=4, ensure_ascii=False))
+        return
+
     root = tk.Tk()
     app = PoliFinApp(root)
     root.mainloop()